@@ -0,0 +1,311 @@
+"""
+Benchmark the moodle cog's commands against the Moodle stub and Postgres.
+
+Simulated users run a command concurrently for a number of rounds. The
+command callbacks run for real, only Discord is faked: messages are recorded
+and menus render their pages instead of sending them. Use a dedicated
+database, the schema is migrated and benchmark users are added (and removed
+afterwards).
+
+    python -m bench.harness --postgresql postgresql://localhost/bench --users 50
+"""
+
+import aiohttp
+import asyncio
+import asyncpg
+import click
+import discord
+import gettext
+import logging
+import math
+import time
+
+from discord.ext import commands
+
+import cogs.moodle
+
+from bench.moodle_stub import MoodleStub
+from cogs.moodle import Moodle
+from cogs.utils.metrics import Metrics
+from cogs.utils.migrations import migrate
+from cogs.utils.repository import Repository
+
+# Discord user ids of simulated users start from here
+USER_ID_BASE = 10**17
+
+# {scenario: (command name, arguments)}
+SCENARIOS = {
+    "courses": ("courses", ("ongoing",)),
+    "homework": ("homework", ()),
+    "changes": ("changes", ()),
+    "refresh": ("refresh", ()),
+}
+
+
+class BenchUser:
+    def __init__(self, id):
+        self.id = id
+        self.mention = f"<@{id}>"
+        self.avatar_url = ""
+
+    def __str__(self):
+        return f"bench#{self.id - USER_ID_BASE}"
+
+
+class BenchTyping:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class BenchContext:
+    """
+    Stands in for commands.Context, records sent messages.
+    """
+
+    def __init__(self, bot, author, command):
+        self.bot = bot
+        self.author = author
+        self.command = command
+        self.prefix = "!"
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content or kwargs.get("embed"))
+
+    def typing(self):
+        return BenchTyping()
+
+
+class BenchPages:
+    """
+    Stands in for ziPages, renders pages instead of sending them.
+
+    Like ziPages, `start` returns once the first page is shown and the
+    remaining pages are rendered in background (see `pending`).
+    """
+
+    pending = []
+
+    def __init__(self, source):
+        self.source = source
+        self.current_page = 0
+        self.message = None
+
+    async def show_page(self, page_number):
+        self.current_page = page_number
+        page = await self.source.get_page(page_number)
+        self.message = await discord.utils.maybe_coroutine(
+            self.source.format_page, self, page
+        )
+
+    async def start(self, ctx):
+        self.ctx = ctx
+        await self.source._prepare_once()
+        await self.show_page(0)
+        self.pending.append(asyncio.ensure_future(self.show_rest()))
+
+    async def show_rest(self):
+        page_number = 1
+        while True:
+            max_pages = self.source.get_max_pages()
+            if max_pages is not None and page_number >= max_pages:
+                return
+            try:
+                await self.show_page(page_number)
+            except IndexError:
+                return
+            page_number += 1
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def db_queries(metrics) -> int:
+    return sum(
+        histogram.count
+        for kind, name, histogram in metrics.summary("db")
+        if name != "acquire"
+    )
+
+
+async def run(dsn, users, rounds, scenarios, cold, stub, replay=None):
+    stub_runner, base_url = await stub.start()
+    pool = await asyncpg.create_pool(dsn)
+    await migrate(pool)
+
+    bot = commands.Bot(command_prefix="!")
+    bot.config = {
+        "moodle_baseurl": base_url,
+        "moodle_disk_cache": False,
+        "moodle_replay": replay,
+    }
+    bot._ = gettext.NullTranslations().gettext
+    bot.logger = logging.getLogger("discord")
+    bot.session = aiohttp.ClientSession()
+    bot.metrics = Metrics()
+    bot.pool = pool
+    bot.db = Repository(pool, max_size=10, metrics=bot.metrics)
+
+    cogs.moodle.ziPages = BenchPages
+    cog = Moodle(bot)
+    bot.add_cog(cog)
+
+    members = [BenchUser(USER_ID_BASE + i) for i in range(users)]
+    user_ids = [member.id for member in members]
+
+    async def reset():
+        for table in ("event", "event_sync", "snapshot", "token"):
+            await pool.execute(
+                f"DELETE FROM elearningbot.{table} WHERE user_id = ANY($1::bigint[])",
+                user_ids,
+            )
+
+    await reset()
+    for member in members:
+        await bot.db.store_token(member.id, f"bench-token-{member.id}")
+
+    results = []
+    try:
+        for scenario in scenarios:
+            name, args = SCENARIOS[scenario]
+            command = bot.get_command(f"get {name}")
+            latencies = []
+            failures = 0
+            requests = stub.requests
+            calls = sum(stub.calls.values())
+            queries = db_queries(bot.metrics)
+
+            async def invoke(member):
+                nonlocal failures
+                ctx = BenchContext(bot, member, command)
+                start = time.perf_counter()
+                try:
+                    await command.callback(cog, ctx, *args)
+                except Exception as e:
+                    failures += 1
+                    bot.logger.warning(f"{scenario} failed: {e!r}")
+                latencies.append(time.perf_counter() - start)
+
+            elapsed = 0.0
+            for _ in range(rounds):
+                if cold:
+                    cog.moodle.cache.clear()
+                    cog.users.clear()
+                    await pool.execute(
+                        "DELETE FROM elearningbot.event_sync "
+                        "WHERE user_id = ANY($1::bigint[])",
+                        user_ids,
+                    )
+                start = time.perf_counter()
+                await asyncio.gather(*[invoke(member) for member in members])
+                await asyncio.gather(*BenchPages.pending)
+                BenchPages.pending.clear()
+                elapsed += time.perf_counter() - start
+
+            ops = len(latencies)
+            results.append(
+                {
+                    "scenario": scenario,
+                    "ops": ops,
+                    "failures": failures,
+                    "throughput": ops / elapsed,
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                    "requests": (stub.requests - requests) / ops,
+                    "calls": (sum(stub.calls.values()) - calls) / ops,
+                    "queries": (db_queries(bot.metrics) - queries) / ops,
+                }
+            )
+    finally:
+        bot.remove_cog(cog.qualified_name)
+        await reset()
+        await asyncio.sleep(0)
+        await bot.session.close()
+        await pool.close()
+        await stub_runner.cleanup()
+    return results
+
+
+def report(results):
+    row = "{:10} {:>6} {:>5} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9}"
+    click.echo(
+        row.format(
+            "scenario",
+            "ops",
+            "fail",
+            "ops/s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "http/op",
+            "wsfn/op",
+            "db/op",
+        )
+    )
+    for result in results:
+        click.echo(
+            row.format(
+                result["scenario"],
+                result["ops"],
+                result["failures"],
+                f"{result['throughput']:.1f}",
+                f"{result['p50'] * 1000:.1f}",
+                f"{result['p95'] * 1000:.1f}",
+                f"{result['p99'] * 1000:.1f}",
+                f"{result['requests']:.2f}",
+                f"{result['calls']:.2f}",
+                f"{result['queries']:.2f}",
+            )
+        )
+
+
+@click.command()
+@click.option("--postgresql", envvar="BENCH_POSTGRESQL", required=True)
+@click.option("--users", default=20, help="Simulated concurrent users.")
+@click.option("--rounds", default=5, help="Times each user runs each command.")
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(list(SCENARIOS)),
+    help="Commands to run, defaults to all.",
+)
+@click.option("--cold", is_flag=True, help="Clear caches before every round.")
+@click.option("--latency", default=0.05, help="Seconds the stub takes to respond.")
+@click.option("--courses", default=8, help="Enrolled courses per user.")
+@click.option("--events", default=10, help="Upcoming events per user.")
+@click.option("--padding", default=0, help="Extra bytes per course/event.")
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Serve responses recorded with `moodle_record` instead of the stub's.",
+)
+def main(
+    postgresql,
+    users,
+    rounds,
+    scenarios,
+    cold,
+    latency,
+    courses,
+    events,
+    padding,
+    replay,
+):
+    """Benchmark the moodle cog."""
+    stub = MoodleStub(latency=latency, courses=courses, events=events, padding=padding)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        run(postgresql, users, rounds, scenarios or list(SCENARIOS), cold, stub, replay)
+    )
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
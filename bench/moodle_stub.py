@@ -0,0 +1,165 @@
+"""
+Local stub of the Moodle endpoints used by `MoodleAPI`.
+
+Serves `login/token.php` and `webservice/rest/server.php` (site info, enrolled
+courses, courses by field, upcoming calendar events and batched calls) with
+generated data, after a configurable latency.
+
+    python -m bench.moodle_stub --port 8099 --latency 0.05
+"""
+
+import asyncio
+import click
+import collections
+import json
+import time
+
+from aiohttp import web
+
+
+class MoodleStub:
+    def __init__(self, *, latency=0.05, courses=8, events=10, padding=0):
+        self.latency = latency
+        self.courses = courses
+        self.events = events
+        # Extra bytes in each course/event description, to control payload size
+        self.padding = padding
+
+        # HTTP requests, and calls of each wsfunction (batched calls included)
+        self.requests = 0
+        self.calls = collections.Counter()
+        self.functions = {
+            "core_webservice_get_site_info": self.site_info,
+            "core_enrol_get_users_courses": self.users_courses,
+            "core_course_get_courses_by_field": self.courses_by_field,
+            "core_calendar_get_calendar_upcoming_view": self.upcoming_view,
+            "tool_mobile_call_external_functions": self.call_external_functions,
+        }
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/login/token.php", self.handle_login)
+        app.router.add_post("/webservice/rest/server.php", self.handle_function)
+        return app
+
+    async def handle_login(self, request):
+        self.requests += 1
+        self.calls["login"] += 1
+        await asyncio.sleep(self.latency)
+        username = request.query.get("username", "")
+        return web.json_response({"token": f"stub-token-{username}"})
+
+    async def handle_function(self, request):
+        data = await request.post()
+        function = data.get("wsfunction")
+        self.requests += 1
+        self.calls[function] += 1
+        await asyncio.sleep(self.latency)
+        if function not in self.functions:
+            return web.json_response(
+                {
+                    "exception": "invalid_parameter_exception",
+                    "errorcode": "invalidrecord",
+                    "message": "Can't find data record in database table "
+                    "external_functions.",
+                }
+            )
+        return web.json_response(self.functions[function](data))
+
+    def userid(self, data) -> int:
+        # Stable fake userid per token
+        return sum(map(ord, data.get("wstoken", ""))) % 100000
+
+    def site_info(self, data):
+        userid = self.userid(data)
+        return {"userid": userid, "username": f"user{userid}", "sitename": "Stub"}
+
+    def course(self, courseid):
+        now = int(time.time())
+        return {
+            "id": courseid,
+            "fullname": f"Course {courseid}",
+            "displayname": f"Course {courseid}",
+            "shortname": f"C{courseid}",
+            "summary": "x" * self.padding,
+            "startdate": now - 30 * 86400,
+            # Every 4th course has ended
+            "enddate": now + (-86400 if courseid % 4 == 0 else 90 * 86400),
+            "progress": courseid * 7 % 100,
+            "contacts": [{"id": 1, "fullname": "Lecturer"}],
+        }
+
+    def users_courses(self, data):
+        return [self.course(courseid) for courseid in range(1, self.courses + 1)]
+
+    def courses_by_field(self, data):
+        value = data.get("value", "")
+        courseids = [int(courseid) for courseid in value.split(",") if courseid]
+        return {"courses": [self.course(courseid) for courseid in courseids]}
+
+    def upcoming_view(self, data):
+        now = int(time.time())
+        padding = "x" * self.padding
+        events = []
+        for i in range(1, self.events + 1):
+            courseid = i % self.courses + 1
+            events.append(
+                {
+                    "id": i,
+                    "name": f"Assignment {i} is due",
+                    "description": f"<p>Submit <b>assignment {i}</b>.</p>{padding}",
+                    "timemodified": now - now % 3600,
+                    "timesort": now + i * 86400,
+                    "url": f"https://moodle.invalid/mod/assign/view.php?id={i}",
+                    "course": {
+                        "id": courseid,
+                        "fullname": f"Course {courseid}",
+                        "viewurl": f"https://moodle.invalid/course/view.php?id={courseid}",
+                    },
+                }
+            )
+        return {"events": events}
+
+    def call_external_functions(self, data):
+        responses = []
+        i = 0
+        while f"requests[{i}][function]" in data:
+            function = data[f"requests[{i}][function]"]
+            arguments = json.loads(data.get(f"requests[{i}][arguments]") or "{}")
+            arguments["wstoken"] = data.get("wstoken", "")
+            self.calls[function] += 1
+            responses.append(
+                {
+                    "error": False,
+                    "data": json.dumps(self.functions[function](arguments)),
+                }
+            )
+            i += 1
+        return {"responses": responses}
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Serve in the running loop, returns `(runner, base url)`.
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        port = runner.addresses[0][1]
+        return runner, f"http://{host}:{port}/"
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8099)
+@click.option("--latency", default=0.05, help="Seconds before each response.")
+@click.option("--courses", default=8, help="Enrolled courses per user.")
+@click.option("--events", default=10, help="Upcoming events per user.")
+@click.option("--padding", default=0, help="Extra bytes per course/event.")
+def main(host, port, latency, courses, events, padding):
+    """Run the Moodle stub server."""
+    stub = MoodleStub(latency=latency, courses=courses, events=events, padding=padding)
+    web.run_app(stub.make_app(), host=host, port=port)
+
+
+if __name__ == "__main__":
+    main()
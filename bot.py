@@ -11,6 +11,11 @@ import sys
 import traceback
 import time
 
+from aiohttp import web
+from cogs.utils.loopmonitor import LoopMonitor
+from cogs.utils.metrics import Metrics
+from cogs.utils.migrations import migrate
+from cogs.utils.repository import Repository
 from discord.errors import NotFound
 from discord.ext import commands
 
@@ -22,6 +27,16 @@ except FileExistsError:
 
 extensions = ["cogs.error_handler", "cogs.admin", "cogs.moodle", "cogs.general", "cogs.help"]
 
+# Gateway intents each extension needs on top of receiving commands, only
+# these are requested in lean mode
+extension_intents = {
+    "cogs.error_handler": ["guild_reactions", "dm_reactions"],
+    "cogs.admin": [],
+    "cogs.moodle": ["guild_reactions", "dm_reactions"],
+    "cogs.general": ["guild_reactions", "dm_reactions"],
+    "cogs.help": ["guild_reactions", "dm_reactions"],
+}
+
 start_time = time.time()
 
 
@@ -30,13 +45,46 @@ def get_prefix(bot, message):
     return commands.when_mentioned_or("!")(bot, message)
 
 
-class ziBot(commands.Bot):
-    def __init__(self):
+def get_intents(lean: bool):
+    """Get gateway intents, in lean mode only what the extensions need."""
+    if not lean:
+        return discord.Intents.all()
+
+    # Needed to receive commands
+    intents = discord.Intents(guilds=True, guild_messages=True, dm_messages=True)
+    for extension in extensions:
+        for intent in extension_intents.get(extension, []):
+            setattr(intents, intent, True)
+    return intents
+
+
+class ziBot(commands.AutoShardedBot):
+    def __init__(self, *, shard_ids=None, shard_count=None):
+        with open("config.json", "r") as f:
+            self.config = json.load(f)
+
+        lean = self.config.get("lean_mode", False)
+        options = {}
+        if lean:
+            # Don't cache members, presences and messages
+            options = dict(
+                member_cache_flags=discord.MemberCacheFlags.none(),
+                chunk_guilds_at_startup=False,
+                max_messages=None,
+            )
+
         super().__init__(
             command_prefix=get_prefix,
             case_insensitive=True,
             allowed_mentions=discord.AllowedMentions(users=True, roles=False),
-            intents=discord.Intents.all(),
+            intents=get_intents(lean),
+            # Defaults to Discord's recommended shard count, all in this process
+            shard_ids=shard_ids,
+            shard_count=shard_count or self.config.get("shard_count"),
+            activity=discord.Activity(
+                name="over your shoulder", type=discord.ActivityType.watching
+            ),
+            **options,
         )
 
         self.localedir = "./locale"
@@ -46,10 +94,19 @@ class ziBot(commands.Bot):
         self._ = self.translate.gettext
 
         self.logger = logging.getLogger("discord")
-        self.session = aiohttp.ClientSession(loop=self.loop)
 
-        with open("config.json", "r") as f:
-            self.config = json.load(f)
+        self.metrics = Metrics()
+        self.instrument_http()
+        self.add_listener(self.count_command_error, "on_command_error")
+        self._metrics_runner = None
+        self.loop_monitor = LoopMonitor(
+            self,
+            interval=self.config.get("loop_monitor_interval", 0.5),
+            threshold=self.config.get("loop_lag_threshold", 0.25),
+        )
+
+        # Shared by every cog, survives cog reloads
+        self.session = self.create_session()
 
         if not self.config["bot_token"]:
             self.logger.error("No token found. Please add it to config.json!")
@@ -57,28 +114,159 @@ class ziBot(commands.Bot):
 
         self.master = [186713080841895936]
 
-    async def create_empty_table(self):
-        await self.pool.execute(
-            """CREATE TABLE IF NOT EXISTS elearningbot.token (user_id text, token text)"""
+        # Set up by start()
+        self.pool = None
+        self.db = None
+        self._ready_once = False
+
+    def create_session(self):
+        """Create HTTP client session with pooled keep-alive connections."""
+        connector = aiohttp.TCPConnector(
+            limit=self.config.get("http_limit", 100),
+            limit_per_host=self.config.get("http_limit_per_host", 20),
+            keepalive_timeout=self.config.get("http_keepalive_timeout", 30),
+            ttl_dns_cache=self.config.get("http_dns_cache_ttl", 300),
+            enable_cleanup_closed=True,
+            loop=self.loop,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.config.get("http_timeout", 30),
+            connect=self.config.get("http_connect_timeout", 10),
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={"Accept-Encoding": "gzip, deflate"},
+            loop=self.loop,
         )
 
-    async def on_ready(self):
-        activity = discord.Activity(
-            name="over your shoulder", type=discord.ActivityType.watching
+    async def create_pool(self):
+        """Create database pool and apply pending migrations."""
+        self.pool = await asyncpg.create_pool(
+            self.config["postgresql"],
+            min_size=self.config.get("postgresql_min_size", 2),
+            max_size=self.config.get("postgresql_max_size", 10),
+            max_queries=self.config.get("postgresql_max_queries", 50000),
+            max_inactive_connection_lifetime=self.config.get(
+                "postgresql_max_inactive_lifetime", 300.0
+            ),
+            statement_cache_size=self.config.get(
+                "postgresql_statement_cache_size", 100
+            ),
+            command_timeout=self.config.get("postgresql_command_timeout", 10.0),
+        )
+        self.db = Repository(
+            self.pool,
+            max_size=self.config.get("postgresql_max_size", 10),
+            metrics=self.metrics,
         )
-        await self.change_presence(activity=activity)
+        version = await migrate(self.pool)
+        self.logger.info(f"Database schema version: {version}")
+
+    def instrument_http(self):
+        """Record latency of Discord API calls."""
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            with self.metrics.timer("discord", f"{route.method} {route.path}"):
+                return await request(route, **kwargs)
 
+        self.http.request = timed_request
+
+    async def start_metrics_server(self):
+        """Serve metrics in Prometheus text format, if metrics_port is set."""
+        port = self.config.get("metrics_port")
+        if not port:
+            return
+
+        async def handle(request):
+            return web.Response(text=self.metrics.prometheus())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._metrics_runner = web.AppRunner(app)
+        await self._metrics_runner.setup()
+        # Each cluster process listens on its own port
+        port += (self.shard_ids or [0])[0]
+        host = self.config.get("metrics_host", "127.0.0.1")
+        try:
+            await web.TCPSite(self._metrics_runner, host, port).start()
+        except OSError as e:
+            # e.g. port already in use, not worth failing the bot for
+            self.logger.warning(f"Failed to serve metrics on {host}:{port}: {e!r}")
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+            return
+        self.logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with self.metrics.timer("command", ctx.command.qualified_name):
+            await super().invoke(ctx)
+
+    async def count_command_error(self, ctx, error):
+        if ctx.command is not None:
+            self.metrics.get("command", ctx.command.qualified_name).errors += 1
+
+    def load_extensions(self):
         for extension in extensions:
-            self.load_extension(extension)
+            try:
+                self.load_extension(extension)
+            except commands.ExtensionError:
+                self.logger.exception(f"Failed to load extension {extension}:")
+
+    async def start(self, *args, **kwargs):
+        """
+        One-time startup pipeline, runs before connecting to the gateway.
+
+        Database setup and login run concurrently, extensions are loaded once
+        the database is ready. Unlike on_ready, this doesn't run again on
+        reconnects.
+        """
+        timings = {}
+        if self.config.get("loop_monitor", True):
+            self.loop_monitor.start()
+
+        async def timed(phase, coro):
+            start = time.perf_counter()
+            await coro
+            timings[phase] = time.perf_counter() - start
 
-        # Create elearningbot schema if not exist
         try:
-            await self.pool.execute("""CREATE SCHEMA elearningbot""")
-        except asyncpg.DuplicateSchemaError:
-            pass
-        await self.create_empty_table()
+            await asyncio.gather(
+                timed("database", self.create_pool()),
+                timed("login", self.login(*args, bot=kwargs.pop("bot", True))),
+                timed("metrics", self.start_metrics_server()),
+            )
+        except Exception as e:
+            self.logger.error(f"Startup failed: {e!r}. Exiting.")
+            return
 
-        self.logger.warning(f"Online: {self.user} (ID: {self.user.id})")
+        start = time.perf_counter()
+        self.load_extensions()
+        timings["extensions"] = time.perf_counter() - start
+
+        self.logger.info(
+            "Startup phases: "
+            + ", ".join(f"{phase} {took:.2f}s" for phase, took in timings.items())
+        )
+        await self.connect(reconnect=kwargs.pop("reconnect", True))
+
+    async def on_ready(self):
+        # Fired again on every reconnect, keep it cheap
+        if self._ready_once:
+            return self.logger.info("Reconnected")
+        self._ready_once = True
+        self.logger.warning(
+            f"Online: {self.user} (ID: {self.user.id}), "
+            f"ready in {time.time() - start_time:.2f}s"
+        )
+        self.logger.info(
+            f"Cache sizes: {len(self.guilds)} guilds, {len(self.users)} users, "
+            f"{sum(len(guild.members) for guild in self.guilds)} members, "
+            f"{len(self.cached_messages)} messages"
+        )
 
     async def on_message(self, message):
         # dont accept commands from bot
@@ -88,8 +276,16 @@ class ziBot(commands.Bot):
         await self.process_commands(message)
 
     async def close(self):
+        self.loop_monitor.stop()
         await super().close()
         await self.session.close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        if self.pool is not None:
+            try:
+                await asyncio.wait_for(self.pool.close(), timeout=10)
+            except asyncio.TimeoutError:
+                self.pool.terminate()
 
     def run(self):
         super().run(self.config["bot_token"], reconnect=True)
@@ -96,6 +96,49 @@ class Admin(commands.Cog):
             await ctx.send(f"{ext} failed to load! Check the log for details.")
             self.bot.logger.exception(f"Failed to reload extension {ext}:")
 
+    @commands.command(usage="[command/wsfunction/db/discord/loop]", hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx, kind: str = None):
+        """Show latency stats."""
+        rows = self.bot.metrics.summary(kind)
+        if not rows:
+            return await ctx.send("No stats recorded yet.")
+
+        row = "{:4} {:34} {:>6} {:>7} {:>7} {:>7} {:>4}"
+        lines = [row.format("kind", "name", "count", "p50", "p95", "max", "err")]
+        for row_kind, name, histogram in rows[:20]:
+            lines.append(
+                row.format(
+                    row_kind[:4],
+                    name[:34],
+                    histogram.count,
+                    f"{histogram.quantile(0.5) * 1000:.0f}",
+                    f"{histogram.quantile(0.95) * 1000:.0f}",
+                    f"{histogram.max * 1000:.0f}",
+                    histogram.errors,
+                )
+            )
+        await ctx.send(
+            "```\n" + "\n".join(lines) + "\n```\nLatency in ms, slowest total first."
+        )
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stalls(self, ctx):
+        """Show where the event loop was blocked recently."""
+        monitor = self.bot.loop_monitor
+        stats = monitor.stats()
+        await ctx.send(
+            f"Max loop lag: {stats['max_lag'] * 1000:.0f} ms, "
+            f"{stats['stalls']} stalls sampled."
+        )
+        for when, blocked, stack in list(monitor.stalls)[-3:]:
+            when = datetime.fromtimestamp(when).strftime("%d/%m/%Y (%H:%M:%S)")
+            await ctx.send(
+                f"{when}, blocked for {blocked * 1000:.0f} ms so far:\n"
+                f"```py\n{stack[-1800:]}```"
+            )
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def pull(self, ctx):
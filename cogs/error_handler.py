@@ -58,16 +58,16 @@ class ErrorHandler(commands.Cog):
             msg = await ctx.send(embed=e)
             await msg.add_reaction("<:greenTick:767209095090274325>")
 
-            def check(reaction, user):
+            # Raw event, the message may not be cached (e.g. in lean mode)
+            def check(payload):
                 return (
-                    user == ctx.author
-                    and str(reaction.emoji) == "<:greenTick:767209095090274325>"
+                    payload.message_id == msg.id
+                    and payload.user_id == ctx.author.id
+                    and str(payload.emoji) == "<:greenTick:767209095090274325>"
                 )
 
             try:
-                reaction, user = await self.bot.wait_for(
-                    "reaction_add", timeout=60.0, check=check
-                )
+                await self.bot.wait_for("raw_reaction_add", timeout=60.0, check=check)
             except asyncio.TimeoutError:
                 e.set_footer(
                     text="You were too late to answer.", icon_url=ctx.author.avatar_url
@@ -75,7 +75,8 @@ class ErrorHandler(commands.Cog):
                 await msg.edit(embed=e)
                 await msg.clear_reactions()
             else:
-                bot_owner = self.bot.get_user(self.bot.master[0])
+                owner_id = self.bot.master[0]
+                bot_owner = self.bot.get_user(owner_id) or await self.bot.fetch_user(owner_id)
                 await bot_owner.send(
                     f"An error occured: `{error}`\nctx.message: `{ctx.message}`\nctx.message.content: `{ctx.message.content}`"
                 )
@@ -19,9 +19,9 @@ class SearxResultsPageSource(menus.ListPageSource):
         return e
 
 class SearxAPI:
-    def __init__(self, base_url):
+    def __init__(self, base_url, session):
         self.base_url = base_url
-        self.session = aiohttp.ClientSession()
+        self.session = session
         self.engines = ['duckduckgo', 'google', 'bing']
 
     async def get_results(self, query: str) -> dict:
@@ -38,7 +38,7 @@ class General(commands.Cog, name="general"):
     def __init__(self, bot):
         self.bot = bot
         self.logger = self.bot.logger
-        self.searx = SearxAPI('https://searx.lukesmith.xyz/')
+        self.searx = SearxAPI('https://searx.lukesmith.xyz/', self.bot.session)
 
     @commands.command(aliases=['searx'])
     async def search(self, ctx, *, keyword):
@@ -4,12 +4,24 @@ import aiohttp
 import discord
 import gettext
 import json
+import logging
 import re
 import sys
+import time
 import traceback
 import urllib
+import weakref
 
-from .utils.paginator import ziPages
+from .utils.breaker import CircuitBreaker
+from .utils.cache import LRUCache, ResponseCache
+from .utils.diskcache import DiskCache
+from .utils.fixtures import FixtureRecorder, FixtureReplayer
+from .utils.leader import Leadership
+from .utils.metrics import Metrics
+from .utils.paginator import StreamPageSource, ziPages
+from .utils.ratelimit import HostRateLimiter
+from .utils.reminder import DeadlineReminder
+from .utils.snapshot import SnapshotRefresher
 from datetime import datetime
 from discord.ext import commands, menus
 from pytz import timezone
@@ -26,12 +38,76 @@ def bar_make(value, gap, *, length=10, point=False, fill="█", empty="░"):
     return bar
 
 
-class MoodleCoursesPageSource(menus.ListPageSource):
-    def __init__(self, ctx, courses):
+# Roughly 6 months, in seconds
+SEMESTER_LENGTH = 183 * 24 * 60 * 60
+
+
+def is_ongoing(course) -> bool:
+    """Course hasn't ended yet."""
+    return datetime.now().timestamp() < course["enddate"]
+
+
+def is_current_semester(course) -> bool:
+    """Course started within the current semester."""
+    return datetime.now().timestamp() - course["startdate"] < SEMESTER_LENGTH
+
+
+# Advisory lock held by the process running background workers
+WORKERS_LOCK_ID = 0x656C6561726F
+
+# Filters of `!get courses (option)`, applied before courses are enriched
+COURSE_FILTERS = {
+    "ongoing": [is_ongoing],
+    "current": [is_ongoing, is_current_semester],
+    "all": [],
+}
+
+
+def format_age(seconds) -> str:
+    """Human readable age, e.g. "5 minutes"."""
+    seconds = int(seconds)
+    for unit, length in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= length:
+            value = seconds // length
+            return f"{value} {unit}{'s' if value > 1 else ''}"
+    return "less than a minute"
+
+
+def html_to_markdown(html: str) -> str:
+    # Very messy way to convert html to markdown
+    regex = [
+        r"(<div(?:.*)?>(.*)</div>)",
+        r"(<h([1-6])>(.*)</h[1-6]>)",
+        r"(<strong>(.*)</strong>)",
+        r"(<p>(.*)</p>)",
+    ]
+    subst = "\\2"
+    content_unfilt = re.sub(r"\r\n", "\\n", html)
+    content_unfilt = re.sub(regex[3], "\\2", content_unfilt)
+    try:
+        content_unfilt = re.sub(
+            regex[1],
+            "{0} \\3".format("-" * int(re.match(regex[1], content_unfilt)[2])),
+            content_unfilt,
+        )
+    except TypeError:
+        pass
+    content_unfilt = re.sub(regex[2], "**\\2**", content_unfilt)
+    return re.sub(regex[0], subst, content_unfilt)
+
+
+class MoodleCoursesPageSource(StreamPageSource):
+    def __init__(self, ctx, courses, *, age=None):
         self.ctx = ctx
-        super().__init__(entries=courses, per_page=1)
+        self.age = age
+        super().__init__(courses)
 
     def format_page(self, menu, course):
+        if course is None:
+            return discord.Embed(
+                description=t_("No courses found."), colour=discord.Colour.blue()
+            )
+
         weblink = f"https://elearning.binadarma.ac.id/course/view.php?id={course['id']}"
         e = discord.Embed(
             title=course["displayname"], url=weblink, colour=discord.Colour.blue()
@@ -54,40 +130,28 @@ class MoodleCoursesPageSource(menus.ListPageSource):
             inline=False,
         )
         e.set_author(name=", ".join([x["fullname"] for x in course["lecturers"]]))
-        maximum = self.get_max_pages()
-        e.set_footer(
-            text=f"Requested by {self.ctx.author} - Page {menu.current_page + 1}/{maximum}",
-            icon_url=self.ctx.author.avatar_url,
+        # Unknown until all courses are loaded
+        maximum = self.get_max_pages() or "?"
+        footer = (
+            f"Requested by {self.ctx.author} - Page {menu.current_page + 1}/{maximum}"
         )
+        if self.age is not None:
+            footer += f" - Updated {format_age(self.age)} ago"
+        e.set_footer(text=footer, icon_url=self.ctx.author.avatar_url)
         return e
 
 
 class MoodleEventsPageSource(menus.ListPageSource):
-    def __init__(self, ctx, events):
+    def __init__(self, ctx, events, *, age=None):
         self.ctx = ctx
+        self.age = age
         super().__init__(entries=events, per_page=1)
 
     def format_page(self, menu, event):
-        # Very messy way to convert html to markdown
-        regex = [
-            r"(<div(?:.*)?>(.*)</div>)",
-            r"(<h([1-6])>(.*)</h[1-6]>)",
-            r"(<strong>(.*)</strong>)",
-            r"(<p>(.*)</p>)",
-        ]
-        subst = "\\2"
-        content_unfilt = re.sub(r"\r\n", "\\n", event["description"])
-        content_unfilt = re.sub(regex[3], "\\2", content_unfilt)
-        try:
-            content_unfilt = re.sub(
-                regex[1],
-                "{0} \\3".format("-" * int(re.match(regex[1], content_unfilt)[2])),
-                content_unfilt,
-            )
-        except TypeError:
-            pass
-        content_unfilt = re.sub(regex[2], "**\\2**", content_unfilt)
-        content = re.sub(regex[0], subst, content_unfilt)
+        # Events from the event store are already converted
+        content = event.get("content")
+        if content is None:
+            content = html_to_markdown(event["description"])
 
         e = discord.Embed(
             title=str(event["name"]).strip(" is due"),
@@ -115,17 +179,176 @@ class MoodleEventsPageSource(menus.ListPageSource):
         )
 
         maximum = self.get_max_pages()
-        e.set_footer(
-            text=f"Requested by {self.ctx.author} - Page {menu.current_page + 1}/{maximum}",
-            icon_url=self.ctx.author.avatar_url,
+        footer = (
+            f"Requested by {self.ctx.author} - Page {menu.current_page + 1}/{maximum}"
         )
+        if self.age is not None:
+            footer += f" - Updated {format_age(self.age)} ago"
+        e.set_footer(text=footer, icon_url=self.ctx.author.avatar_url)
         return e
 
 
+class MoodleUnavailable(Exception):
+    """Raised when requests to Moodle fail fast, because it keeps failing."""
+
+    pass
+
+
+class MoodleBatch(object):
+    """
+    Queue of Moodle webservice function calls, requested together on flush.
+
+    Usage:
+        async with moodle.batch(token) as batch:
+            info = batch.add("core_webservice_get_site_info")
+        info.result()
+    """
+
+    def __init__(self, api, token: str):
+        self.api = api
+        self.token = token
+        self._calls = []
+
+    def add(self, function: str, **params) -> asyncio.Future:
+        """
+        Queue a function call, the returned future resolves on flush.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._calls.append((function, params, future))
+        return future
+
+    async def flush(self):
+        """
+        Request all queued function calls.
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+        try:
+            results = await self.api.call_external_functions(
+                self.token, [(function, params) for function, params, _ in calls]
+            )
+        except Exception as e:
+            for _, _, future in calls:
+                future.set_exception(e)
+            raise
+        for i, (_, _, future) in enumerate(calls):
+            future.set_result(results[i] if i < len(results) else None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+        else:
+            for _, _, future in self._calls:
+                future.cancel()
+            self._calls = []
+
+
 class MoodleAPI(object):
-    def __init__(self, base_url):
-        self.session = aiohttp.ClientSession()
+    # Default response cache TTL (in seconds) of each webservice function
+    CACHE_TTLS = {
+        "core_webservice_get_site_info": 3600,
+        "core_enrol_get_users_courses": 300,
+        "core_course_get_courses_by_field": 3600,
+        "core_calendar_get_calendar_upcoming_view": 120,
+        "tool_mobile_call_external_functions": 0,
+    }
+    # Functions that don't depend on the user, their responses are shared
+    # across tokens (both cached and in-flight)
+    SHARED_FUNCTIONS = {"core_course_get_courses_by_field"}
+
+    def __init__(
+        self,
+        base_url,
+        session,
+        *,
+        concurrency=8,
+        user_concurrency=4,
+        course_chunk_size=50,
+        cache_size=2048,
+        cache_ttls=None,
+        cache_stale_ttl=600,
+        rate_limit=10.0,
+        rate_burst=20,
+        max_inflight=16,
+        breaker_threshold=5,
+        breaker_reset_timeout=30.0,
+        disk_cache=None,
+        metrics=None,
+        recorder=None,
+        replayer=None,
+    ):
+        self.session = session
         self.base_url = base_url
+        self.logger = logging.getLogger("discord")
+        self.course_chunk_size = course_chunk_size
+        self.metrics = metrics or Metrics()
+
+        self.cache = ResponseCache(
+            cache_size,
+            ttls=dict(self.CACHE_TTLS, **(cache_ttls or {})),
+            stale_ttl=cache_stale_ttl,
+        )
+        # Persistent cache read through on misses and written behind, so
+        # restarts start warm
+        self.disk = disk_cache
+        # {token: when it was forgotten}, older disk entries of the token are
+        # ignored. Kept as long as an entry stored before then may be used
+        self._forgotten = LRUCache(
+            maxsize=cache_size,
+            ttl=max([self.cache.default_ttl, *self.cache.ttls.values()])
+            + self.cache.stale_ttl,
+        )
+        self._revalidating = set()
+        # Record responses to fixture files, or serve recorded responses
+        # instead of requesting Moodle
+        self.recorder = recorder
+        self.replayer = replayer
+        # Single-flight, {key: future of the request currently in-flight}
+        self._inflight = {}
+
+        # Limit request rate to the site, queued fairly across tokens
+        self.limiter = HostRateLimiter(
+            rate_limit, burst=rate_burst, max_inflight=max_inflight
+        )
+
+        # Fail fast (or serve stale cache) while the site is down
+        self.breaker = CircuitBreaker(
+            "moodle", threshold=breaker_threshold, reset_timeout=breaker_reset_timeout
+        )
+
+        # Limit concurrent requests, globally and per-user (keyed by token)
+        self.user_concurrency = user_concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._user_semaphores = weakref.WeakValueDictionary()
+
+    def _user_semaphore(self, token: str):
+        semaphore = self._user_semaphores.get(token)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.user_concurrency)
+            self._user_semaphores[token] = semaphore
+        return semaphore
+
+    async def gather_bounded(self, token: str, coros) -> list:
+        """
+        Run coroutines concurrently.
+
+        Bounded by both per-user and global concurrency limit, results keep
+        the order of `coros` and exceptions are returned instead of raised.
+        """
+        user_semaphore = self._user_semaphore(token)
+
+        async def run(coro):
+            async with user_semaphore:
+                async with self._semaphore:
+                    return await coro
+
+        return await asyncio.gather(
+            *[run(coro) for coro in coros], return_exceptions=True
+        )
 
     async def get_token(self, username: str, password: str):
         """
@@ -133,16 +356,24 @@ class MoodleAPI(object):
 
         Required by most Moodle webservice function.
         """
+        params = {"username": username, "password": password}
         username = "username=" + username
         password = "password=" + urllib.parse.quote(password)
-        res = None
-        async with self.session.post(
-            self.base_url
-            + "login/token.php?service=moodle_mobile_app"
-            + "&"
-            + "&".join([username, password])
-        ) as page:
-            res = json.loads(await page.text())
+        with self.metrics.timer("wsfunction", "login"):
+            if self.replayer is not None:
+                res = await self.replayer.replay("login", params)
+            else:
+                start = time.perf_counter()
+                res = await self._post(
+                    self.base_url
+                    + "login/token.php?service=moodle_mobile_app"
+                    + "&"
+                    + "&".join([username, password])
+                )
+                if self.recorder is not None:
+                    self.recorder.record(
+                        "login", params, res, time.perf_counter() - start
+                    )
         try:
             if res:
                 return res["token"]
@@ -150,20 +381,39 @@ class MoodleAPI(object):
         except KeyError:
             return None
 
-    async def get_func_json(self, token: str, function: str):
+    async def get_func_json(self, token: str, function: str, **params):
         """
         Request function.
 
-        Get data with specific Moodle webservice function.
+        Get data with specific Moodle webservice function, `params` are passed
+        as the function's arguments. Responses are cached, stale responses are
+        returned right away while being refreshed in background. Identical
+        concurrent requests share a single HTTP request.
         """
-        async with self.session.post(
-            self.base_url
-            + "webservice/rest/server.php?moodlewsrestformat=json&wstoken="
-            + token
-            + "&wsfunction="
-            + function
-        ) as page:
-            res = json.loads(await page.text())
+        key = self._cache_key(token, function, params)
+        if self._cacheable(function):
+            res, state = self.cache.get(key, function)
+            if state == "stale":
+                self._revalidate(key, token, function, params)
+            if state:
+                return res
+        return await self._fetch(key, token, function, params)
+
+    async def _request(self, token: str, function: str, params: dict):
+        data = {key: str(value) for key, value in params.items()}
+        data.update(moodlewsrestformat="json", wstoken=token, wsfunction=function)
+        with self.metrics.timer("wsfunction", function):
+            if self.replayer is not None:
+                res = await self.replayer.replay(function, params)
+            else:
+                start = time.perf_counter()
+                res = await self._post(
+                    self.base_url + "webservice/rest/server.php", user=token, data=data
+                )
+                if self.recorder is not None:
+                    self.recorder.record(
+                        function, params, res, time.perf_counter() - start, token=token
+                    )
         try:
             if res:
                 return res
@@ -171,6 +421,251 @@ class MoodleAPI(object):
         except KeyError:
             return None
 
+    async def _post(self, url: str, *, user=None, **kwargs):
+        """
+        POST to Moodle and decode the JSON response.
+
+        Goes through the circuit breaker and rate limiter, server errors and
+        timeouts make the limiter back off and count towards opening the breaker.
+        """
+        if not self.breaker.allow():
+            raise MoodleUnavailable("Moodle is unreachable, try again later.")
+
+        failed = None
+        try:
+            await self.limiter.acquire(user)
+            try:
+                async with self.session.post(url, **kwargs) as page:
+                    failed = page.status >= 500
+                    text = await page.text()
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                failed = True
+                raise
+            finally:
+                self.limiter.release(failed=failed)
+        finally:
+            self.breaker.record(failed)
+        return json.loads(text)
+
+    def _cache_key(self, token: str, function: str, params: dict):
+        return (
+            None if function in self.SHARED_FUNCTIONS else token,
+            function,
+            tuple(sorted((key, str(value)) for key, value in params.items())),
+        )
+
+    def _cacheable(self, function: str) -> bool:
+        return self.cache.ttl_for(function) > 0
+
+    def _store(self, key, function: str, res):
+        # Don't cache errors
+        if res is None or (isinstance(res, dict) and "exception" in res):
+            return
+        self.cache.set(key, function, res)
+        if self.disk is not None:
+            self.disk.set(key, res)
+
+    async def _load(self, key, function: str):
+        """
+        Read through to the disk cache.
+
+        Returns `(value, fresh)` or None on miss, the value is put back into
+        the memory cache.
+        """
+        if self.disk is None or not self._cacheable(function):
+            return None
+        cached = await self.disk.get(key)
+        if cached is None:
+            return None
+        res, age = cached
+        if age >= self.cache.ttl_for(function) + self.cache.stale_ttl:
+            return None
+        forgotten = self._forgotten.get(key[0])
+        if forgotten is not None and time.time() - age <= forgotten:
+            return None
+        self.cache.set(key, function, res, age=age)
+        return res, age < self.cache.ttl_for(function)
+
+    async def _fetch(self, key, token: str, function: str, params: dict):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._request_and_store(key, token, function, params)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, a cancelled waiter shouldn't cancel the other waiters
+        return await asyncio.shield(task)
+
+    async def _request_and_store(self, key, token: str, function: str, params):
+        cached = await self._load(key, function)
+        if cached and cached[1]:
+            return cached[0]
+        try:
+            res = await self._request(token, function, params)
+        except MoodleUnavailable:
+            # Stale is better than nothing
+            if cached:
+                return cached[0]
+            raise
+        self._store(key, function, res)
+        return res
+
+    def _revalidate(self, key, token: str, function: str, params: dict):
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+
+        def done(task):
+            self._revalidating.discard(key)
+            if task.cancelled() or isinstance(task.exception(), MoodleUnavailable):
+                return
+            if task.exception():
+                self.logger.warning(
+                    f"Failed to refresh {function}: {task.exception()!r}"
+                )
+
+        task = asyncio.ensure_future(self._fetch(key, token, function, params))
+        task.add_done_callback(done)
+
+    async def call_external_functions(self, token: str, calls: list) -> list:
+        """
+        Request multiple functions in a single request.
+
+        `calls` is a list of `(function, params)` tuples, results are returned
+        in the same order. Cached and in-flight responses are reused, only the
+        rest are requested.
+        """
+        results = [None] * len(calls)
+        missing = []
+        for i, (function, params) in enumerate(calls):
+            if self._cacheable(function):
+                key = self._cache_key(token, function, params)
+                res, state = self.cache.get(key, function)
+                if state == "stale":
+                    self._revalidate(key, token, function, params)
+                if state:
+                    results[i] = res
+                    continue
+            missing.append(i)
+
+        # Join identical requests that are already in-flight
+        loop = asyncio.get_event_loop()
+        joined = {}
+        owned = {}
+        for i in missing:
+            function, params = calls[i]
+            key = self._cache_key(token, function, params)
+            if key in self._inflight:
+                joined[i] = self._inflight[key]
+            else:
+                owned[i] = key
+                self._inflight[key] = loop.create_future()
+
+        fetched = []
+        if owned:
+            try:
+                loaded = await asyncio.gather(
+                    *[self._load(key, calls[i][0]) for i, key in owned.items()]
+                )
+                for (i, key), cached in zip(list(owned.items()), loaded):
+                    if cached and cached[1]:
+                        del owned[i]
+                        self._inflight.pop(key).set_result(cached[0])
+                        results[i] = cached[0]
+                if owned:
+                    fetched = await self._call_external_functions(
+                        token, [calls[i] for i in owned]
+                    )
+            except BaseException as e:
+                for key in owned.values():
+                    future = self._inflight.pop(key)
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+                        future.exception()  # Mark as retrieved
+                raise
+
+        for n, (i, key) in enumerate(owned.items()):
+            # Every owned key is resolved, joined requests would wait forever
+            res = fetched[n] if n < len(fetched) else None
+            function, params = calls[i]
+            self._store(key, function, res)
+            self._inflight.pop(key).set_result(res)
+            results[i] = res
+        for i, future in joined.items():
+            results[i] = await asyncio.shield(future)
+        return results
+
+    async def _call_external_functions(self, token: str, calls: list) -> list:
+        """
+        Falls back to requesting each function separately if the site doesn't
+        support `tool_mobile_call_external_functions`.
+        """
+        if len(calls) == 1:
+            function, params = calls[0]
+            return [await self._request(token, function, params)]
+
+        params = {}
+        for i, (function, arguments) in enumerate(calls):
+            params[f"requests[{i}][function]"] = function
+            params[f"requests[{i}][arguments]"] = json.dumps(
+                {key: str(value) for key, value in arguments.items()}
+            )
+        res = await self._request(token, "tool_mobile_call_external_functions", params)
+        try:
+            responses = res["responses"]
+        except (KeyError, TypeError):
+            self.logger.warning(f"Batched request failed, falling back: {res!r}")
+            results = await self.gather_bounded(
+                token,
+                [self._request(token, function, params) for function, params in calls],
+            )
+            for result in results:
+                # Not a failed function, same as a failed non-batched request
+                if isinstance(result, MoodleUnavailable):
+                    raise result
+            return [
+                None if isinstance(result, BaseException) else result
+                for result in results
+            ]
+
+        results = []
+        for response in responses:
+            if response["error"]:
+                # Same shape as a failed non-batched request
+                results.append(json.loads(response["exception"]))
+            else:
+                results.append(json.loads(response["data"] or "null"))
+        # Moodle stops at the first failed call, the rest weren't run
+        results += [None] * (len(calls) - len(results))
+        return results
+
+    def response_age(self, token: str, function: str, **params) -> float:
+        """
+        Seconds since the response of a call was fetched from Moodle.
+
+        Call right after getting the response, it may be a stale cached one.
+        Uncached responses were just fetched, their age is 0.
+        """
+        age = self.cache.age(self._cache_key(token, function, params))
+        return age or 0.0
+
+    def forget(self, token: str):
+        """
+        Drop cached responses of a token, from memory and disk.
+        """
+        self._forgotten.set(token, time.time())
+        for key in [key for key in self.cache.keys() if key[0] == token]:
+            self.cache.pop(key)
+
+    def batch(self, token: str):
+        """
+        Queue function calls to be requested together, see `MoodleBatch`.
+        """
+        return MoodleBatch(self, token)
+
     async def get_userid(self, token: str) -> str:
         """
         Get userid from token.
@@ -180,55 +675,238 @@ class MoodleAPI(object):
         userid = await self.get_func_json(token, "core_webservice_get_site_info")
         try:
             userid = userid["userid"]
-        except KeyError:
+        except (KeyError, TypeError):
             return None
         return userid
 
-    async def get_raw_enrolled_courses(self, userid, token) -> list:
+    async def _get_users_courses(self, userid, token, filters) -> list:
+        _courses = await self.get_func_json(
+            token, "core_enrol_get_users_courses", userid=userid
+        )
+        return [
+            course for course in _courses if all(check(course) for check in filters)
+        ]
+
+    @staticmethod
+    def _make_course(course: dict, info: dict) -> dict:
+        if info is None:
+            # Fallback to enrolment data, so 1 failed course doesn't break the list
+            info = dict(course, contacts=[])
+            info.setdefault("displayname", course["fullname"])
+        return {
+            "id": info["id"],
+            "displayname": info["displayname"],
+            "startdate": info["startdate"],
+            "enddate": info["enddate"],
+            "progress": course["progress"],
+            "lecturers": info["contacts"],
+        }
+
+    async def get_raw_enrolled_courses(self, userid, token, *, filters=()) -> list:
         """
-        Get list of raw enrolled courses. Unfiltered
+        Get list of raw enrolled courses.
+
+        `filters` are predicates taking the course's enrolment data, only
+        courses passing all of them are enriched with full course information.
         """
-        _courses = await self.get_func_json(
-            token, f"core_enrol_get_users_courses&userid={userid}"
-        )
-        courses = []
-        for course in _courses:
-            info = await self.get_course_info(course["id"], token)
-            courses.append(
-                {
-                    "id": info["id"],
-                    "displayname": info["displayname"],
-                    "startdate": info["startdate"],
-                    "enddate": info["enddate"],
-                    "progress": course["progress"],
-                    "lecturers": info["contacts"],
-                }
+        _courses = await self._get_users_courses(userid, token, filters)
+        infos = await self.get_courses_info(
+            [course["id"] for course in _courses], token
+        )
+        return [
+            self._make_course(course, infos.get(course["id"])) for course in _courses
+        ]
+
+    async def iter_enrolled_courses(self, userid, token, *, filters=None, first=1):
+        """
+        Iterate over enrolled courses as they're enriched.
+
+        The `first` courses are requested on their own so they can be shown
+        right away, the rest are requested together in background.
+        """
+        if filters is None:
+            filters = COURSE_FILTERS["ongoing"]
+        _courses = await self._get_users_courses(userid, token, filters)
+        head, tail = _courses[:first], _courses[first:]
+
+        tail_infos = asyncio.ensure_future(
+            self.get_courses_info([course["id"] for course in tail], token)
+        )
+        try:
+            infos = await self.get_courses_info(
+                [course["id"] for course in head], token
             )
+            for course in head:
+                yield self._make_course(course, infos.get(course["id"]))
 
-        return list(courses)
+            infos = await tail_infos
+            for course in tail:
+                yield self._make_course(course, infos.get(course["id"]))
+        finally:
+            tail_infos.cancel()
 
-    async def get_enrolled_courses(self, userid, token) -> list:
+    async def get_enrolled_courses(self, userid, token, *, filters=None) -> list:
         """
         Get list of enrolled courses. Filtered, only show courses that still on-going
+
+        Courses are filtered before they're enriched, see `COURSE_FILTERS`.
         """
-        unfiltered = await self.get_raw_enrolled_courses(userid, token)
-        # _json = await self.get_func_json(token, f"core_enrol_get_users_courses&userid={userid}")
-        courses = []
-        # filter courses that already ends
-        for course in unfiltered:
-            if datetime.now().timestamp() < course["enddate"]:
-                courses.append(course)
-        return courses
+        if filters is None:
+            filters = COURSE_FILTERS["ongoing"]
+        return await self.get_raw_enrolled_courses(userid, token, filters=filters)
 
     async def get_course_info(self, courseid, token) -> dict:
         """
         Get course full information.
         """
         info = await self.get_func_json(
-            token, f"core_course_get_courses_by_field&field=id&value={courseid}"
+            token, "core_course_get_courses_by_field", field="id", value=courseid
         )
         return info["courses"][0]
 
+    def _course_key(self, courseid):
+        # Same entry as `get_course_info`'s request, shared across users
+        return self._cache_key(
+            None, "core_course_get_courses_by_field", {"field": "id", "value": courseid}
+        )
+
+    async def get_courses_info(self, courseids, token) -> dict:
+        """
+        Get full information of multiple courses, mapped by course id.
+
+        Courses are cached and shared across users per course id, only those
+        that aren't cached or in-flight are requested, in chunks of
+        `course_chunk_size` ids batched into a single request. Courses that
+        failed are left out of the result.
+        """
+        function = "core_course_get_courses_by_field"
+        results = {}
+        joined = {}
+        owned = {}
+        stale = []
+        for courseid in dict.fromkeys(courseids):
+            key = self._course_key(courseid)
+            res, state = self.cache.get(key, function)
+            if state == "stale":
+                stale.append(courseid)
+            if state:
+                results[courseid] = res
+            elif key in self._inflight:
+                joined[courseid] = self._inflight[key]
+            else:
+                owned[courseid] = key
+
+        if stale:
+            self._revalidate_courses(token, stale)
+        if owned:
+            results.update(await self._fetch_courses(token, owned))
+        for courseid, future in joined.items():
+            results[courseid] = await asyncio.shield(future)
+
+        infos = {}
+        for courseid, res in results.items():
+            try:
+                infos[courseid] = res["courses"][0]
+            except (KeyError, IndexError, TypeError):
+                pass
+        return infos
+
+    async def _fetch_courses(self, token: str, owned: dict) -> dict:
+        """
+        Request courses, `owned` maps their ids to cache keys.
+
+        They're in-flight until done, courses fresh in the disk cache aren't
+        requested. Returns `{courseid: response}`, None for failed courses.
+        """
+        function = "core_course_get_courses_by_field"
+        loop = asyncio.get_event_loop()
+        for key in owned.values():
+            self._inflight[key] = loop.create_future()
+
+        results = {}
+        try:
+            loaded = await asyncio.gather(
+                *[self._load(key, function) for key in owned.values()]
+            )
+            missing = []
+            stale = {}
+            for courseid, cached in zip(owned, loaded):
+                if cached and cached[1]:
+                    results[courseid] = cached[0]
+                    continue
+                missing.append(courseid)
+                if cached:
+                    stale[courseid] = cached[0]
+
+            chunks = [
+                missing[i : i + self.course_chunk_size]
+                for i in range(0, len(missing), self.course_chunk_size)
+            ]
+            calls = [
+                (function, {"field": "ids", "value": ",".join(map(str, chunk))})
+                for chunk in chunks
+            ]
+            try:
+                responses = await self._call_external_functions(token, calls)
+            except MoodleUnavailable:
+                # Stale is better than nothing
+                if len(stale) < len(missing):
+                    raise
+                responses = [None] * len(chunks)
+
+            for chunk, response in zip(chunks, responses):
+                try:
+                    found = {str(info["id"]): info for info in response["courses"]}
+                except (KeyError, TypeError):
+                    if response is not None:
+                        self.logger.warning(
+                            f"Failed to get info for courses {chunk}: {response!r}"
+                        )
+                    found = {}
+                for courseid in chunk:
+                    info = found.get(str(courseid))
+                    if info is None:
+                        results[courseid] = stale.get(courseid)
+                        continue
+                    res = {"courses": [info]}
+                    self._store(owned[courseid], function, res)
+                    results[courseid] = res
+        except BaseException as e:
+            for key in owned.values():
+                future = self._inflight.pop(key)
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    future.exception()  # Mark as retrieved
+            raise
+
+        for courseid, key in owned.items():
+            self._inflight.pop(key).set_result(results.get(courseid))
+        return results
+
+    def _revalidate_courses(self, token: str, courseids: list):
+        owned = {}
+        for courseid in courseids:
+            key = self._course_key(courseid)
+            if key not in self._revalidating and key not in self._inflight:
+                owned[courseid] = key
+        if not owned:
+            return
+        self._revalidating.update(owned.values())
+
+        def done(task):
+            self._revalidating.difference_update(owned.values())
+            if task.cancelled() or isinstance(task.exception(), MoodleUnavailable):
+                return
+            if task.exception():
+                self.logger.warning(
+                    f"Failed to refresh courses {list(owned)}: {task.exception()!r}"
+                )
+
+        task = asyncio.ensure_future(self._fetch_courses(token, owned))
+        task.add_done_callback(done)
+
 
 class Moodle(commands.Cog, name="moodle"):
     def __init__(self, bot):
@@ -236,11 +914,154 @@ class Moodle(commands.Cog, name="moodle"):
         global t_
         t_ = self.bot._
         self.logger = self.bot.logger
-        self.conn = self.bot.pool
-        self.moodle = MoodleAPI(self.bot.config["moodle_baseurl"])
+        self.conn = self.bot.db
+        self.disk_cache = None
+        if self.bot.config.get("moodle_disk_cache", True):
+            # Size is in MiB
+            size = self.bot.config.get("moodle_disk_cache_size", 64)
+            self.disk_cache = DiskCache(
+                "data/moodle_cache.sqlite3",
+                max_size=size * 1024 * 1024,
+                max_age=self.bot.config.get("moodle_disk_cache_max_age", 86400),
+            )
+            self.bot.loop.create_task(self.disk_cache.open())
+        self.recorder = None
+        self.replayer = None
+        if self.bot.config.get("moodle_replay"):
+            self.replayer = FixtureReplayer(
+                self.bot.config["moodle_replay"],
+                speed=self.bot.config.get("moodle_replay_speed", 1.0),
+            )
+        elif self.bot.config.get("moodle_record"):
+            self.recorder = FixtureRecorder(self.bot.config["moodle_record"])
+        self.moodle = MoodleAPI(
+            self.bot.config["moodle_baseurl"],
+            self.bot.session,
+            concurrency=self.bot.config.get("moodle_concurrency", 8),
+            user_concurrency=self.bot.config.get("moodle_user_concurrency", 4),
+            course_chunk_size=self.bot.config.get("moodle_course_chunk_size", 50),
+            cache_size=self.bot.config.get("moodle_cache_size", 2048),
+            cache_ttls=self.bot.config.get("moodle_cache_ttl"),
+            cache_stale_ttl=self.bot.config.get("moodle_cache_stale_ttl", 600),
+            rate_limit=self.bot.config.get("moodle_rate_limit", 10.0),
+            rate_burst=self.bot.config.get("moodle_rate_burst", 20),
+            max_inflight=self.bot.config.get("moodle_max_inflight", 16),
+            breaker_threshold=self.bot.config.get("moodle_breaker_threshold", 5),
+            breaker_reset_timeout=self.bot.config.get(
+                "moodle_breaker_reset_timeout", 30.0
+            ),
+            disk_cache=self.disk_cache,
+            metrics=self.bot.metrics,
+            recorder=self.recorder,
+            replayer=self.replayer,
+        )
         global moodle
         moodle = self.moodle
 
+        # {discord user id: {"token": token, "userid": moodle userid}}
+        self.users = LRUCache(
+            maxsize=self.bot.config.get("user_cache_size", 4096),
+            ttl=self.bot.config.get("user_cache_ttl", 3600),
+        )
+        self._listener_conn = None
+        self._listener_task = self.bot.loop.create_task(self.listen_token_changes())
+
+        # Seconds the event store is used before syncing with Moodle again
+        self.event_sync_ttl = self.bot.config.get("event_sync_ttl", 120)
+
+        self.reminder = DeadlineReminder(
+            self,
+            lead_times=self.bot.config.get("reminder_lead_times", [86400, 3600]),
+            concurrency=self.bot.config.get("reminder_concurrency", 4),
+            min_interval=self.bot.config.get("reminder_min_interval", 600),
+            max_interval=self.bot.config.get("reminder_max_interval", 21600),
+        )
+        # Commands answer from snapshots in every process, only the leader
+        # refreshes them (non-leaders' enqueues are picked up by its feed)
+        self.snapshots_enabled = self.bot.config.get("snapshot_enabled", False)
+        self.snapshots = SnapshotRefresher(
+            self,
+            workers=self.bot.config.get("snapshot_workers", 4),
+            max_age=self.bot.config.get("snapshot_max_age", 900),
+        )
+
+        # Background workers only run in 1 process when clustered
+        self.leadership = Leadership(
+            self.bot,
+            WORKERS_LOCK_ID,
+            on_elected=self.start_workers,
+            on_demoted=self.stop_workers,
+        )
+        self.leadership.start()
+
+    def start_workers(self):
+        if self.bot.config.get("reminder_enabled", False):
+            self.reminder.start()
+        if self.snapshots_enabled:
+            self.snapshots.start()
+
+    def stop_workers(self):
+        self.reminder.stop()
+        self.snapshots.stop()
+
+    def cog_unload(self):
+        self.leadership.stop()
+        self.stop_workers()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        self._listener_task.cancel()
+        self.bot.loop.create_task(self.unlisten_token_changes())
+
+    async def listen_token_changes(self, interval=30.0):
+        """
+        Invalidate cached users when their token is changed in the database.
+
+        The listening connection is checked every `interval` seconds and
+        replaced if it's lost (e.g. Postgres restarted), cached users are
+        dropped then since their changes might have been missed.
+        """
+        while True:
+            try:
+                if self._listener_conn is None:
+                    self._listener_conn = await self.bot.pool.acquire()
+                    await self._listener_conn.add_listener(
+                        "elearningbot_token", self.on_token_change
+                    )
+                    self.users.clear()
+                else:
+                    await self._listener_conn.fetchval("SELECT 1")
+            except Exception as e:
+                self.logger.warning(f"Lost token changes listener: {e!r}")
+                await self.unlisten_token_changes()
+            await asyncio.sleep(interval)
+
+    async def unlisten_token_changes(self):
+        conn, self._listener_conn = self._listener_conn, None
+        if conn is None:
+            return
+        try:
+            await conn.remove_listener("elearningbot_token", self.on_token_change)
+        except Exception:
+            pass
+        try:
+            await self.bot.pool.release(conn)
+        except Exception:
+            pass
+
+    def on_token_change(self, connection, pid, channel, payload):
+        user_id = int(payload)
+        self.users.pop(user_id)
+        # Registered in another process, removed users are dropped on poll
+        self.reminder.add_user(user_id)
+
+    def cache_user(self, member: discord.User, token: str, userid=None):
+        """
+        Cache user's token and Moodle userid.
+        """
+        self.users.set(member.id, {"token": token, "userid": userid})
+
     async def is_registered(self, ctx) -> bool:
         """
         Check if user's token registered.
@@ -250,25 +1071,246 @@ class Moodle(commands.Cog, name="moodle"):
 
     async def fetch_token(self, member: discord.User) -> str:
         """
-        Get token from database
+        Get token from cache or database
+        """
+        cached = self.users.get(member.id)
+        if cached:
+            return cached["token"]
+
+        token = await self.conn.fetch_token(member.id)
+        if not token:
+            return None
+        self.cache_user(member, token)
+        return token
+
+    async def fetch_userid(self, member: discord.User):
         """
-        token = await self.conn.fetchrow(
+        Get user's Moodle userid
+        """
+        token = await self.fetch_token(member)
+        cached = self.users.get(member.id)
+        if cached and cached["userid"]:
+            return cached["userid"]
+
+        userid = await self.moodle.get_userid(token)
+        if userid:
+            self.cache_user(member, token, userid)
+        return userid
+
+    async def store_events(self, user_id: int, events: list, *, age=0.0):
+        """
+        Update user's event store with upcoming events from Moodle.
+
+        Only new or modified events (by `timemodified`) are converted and saved,
+        events that are no longer upcoming are removed. `age` is how many
+        seconds ago the events were fetched (they may come from the cache).
+        """
+        known = {
+            row["event_id"]: row["timemodified"]
+            for row in await self.conn.fetch(
+                """
+                SELECT event_id, timemodified FROM elearningbot.event
+                WHERE user_id = $1
+                """,
+                user_id,
+            )
+        }
+        changed = [
+            (
+                user_id,
+                event["id"],
+                event["timemodified"],
+                event["timesort"],
+                json.dumps(event),
+                html_to_markdown(event["description"]),
+            )
+            for event in events
+            if known.get(event["id"]) != event["timemodified"]
+        ]
+        async with self.conn.acquire() as conn:
+            async with conn.transaction():
+                if changed:
+                    await conn.executemany(
+                        """
+                        INSERT INTO elearningbot.event
+                            (user_id, event_id, timemodified, timesort, data, content)
+                        VALUES ($1, $2, $3, $4, $5::jsonb, $6)
+                        ON CONFLICT (user_id, event_id) DO UPDATE SET
+                            timemodified = EXCLUDED.timemodified,
+                            timesort = EXCLUDED.timesort,
+                            data = EXCLUDED.data,
+                            content = EXCLUDED.content,
+                            updated_at = now()
+                        """,
+                        changed,
+                    )
+                await conn.execute(
+                    """
+                    DELETE FROM elearningbot.event
+                    WHERE user_id = $1 AND NOT event_id = ANY($2::bigint[])
+                    """,
+                    user_id,
+                    [event["id"] for event in events],
+                )
+                await conn.execute(
+                    """
+                    INSERT INTO elearningbot.event_sync (user_id, synced_at)
+                    VALUES ($1, now() - make_interval(secs => $2))
+                    ON CONFLICT (user_id) DO UPDATE SET synced_at = EXCLUDED.synced_at
+                    """,
+                    user_id,
+                    float(age),
+                )
+
+    async def event_sync_age(self, user_id: int):
+        """
+        Seconds since user's event store is synced, None if it's never synced.
+        """
+        return await self.conn.fetchval(
             """
-            SELECT * FROM elearningbot.token 
+            SELECT extract(epoch FROM now() - synced_at) FROM elearningbot.event_sync
             WHERE user_id = $1
             """,
-            str(member.id),
+            user_id,
         )
-        if not token:
+
+    async def fetch_stored_events(self, user_id: int, *, max_age=None, changed=False):
+        """
+        Get upcoming events from user's event store.
+
+        Returns None if it's never synced, or synced more than `max_age` seconds
+        ago. `changed` only returns events modified since user last saw them.
+        """
+        age = await self.event_sync_age(user_id)
+        if age is None or (max_age is not None and age > max_age):
             return None
-        return token[1]
 
-    async def fetch_userid(self, member: discord.User):
+        rows = await self.conn.fetch(
+            """
+            SELECT event.data, event.content FROM elearningbot.event AS event
+            JOIN elearningbot.event_sync AS sync USING (user_id)
+            WHERE user_id = $1
+            AND (NOT $2 OR sync.seen_at IS NULL OR event.updated_at > sync.seen_at)
+            ORDER BY event.timesort
+            """,
+            user_id,
+            changed,
+        )
+        return [dict(json.loads(row["data"]), content=row["content"]) for row in rows]
+
+    async def mark_events_seen(self, user_id: int):
+        await self.conn.execute(
+            """
+            UPDATE elearningbot.event_sync SET seen_at = now()
+            WHERE user_id = $1
+            """,
+            user_id,
+        )
+
+    async def sync_events(self, user_id: int, token: str) -> list:
         """
-        Get user's Moodle userid
+        Get upcoming events from Moodle and update user's event store.
+        """
+        res = await self.moodle.get_func_json(
+            token, "core_calendar_get_calendar_upcoming_view"
+        )
+        age = self.moodle.response_age(
+            token, "core_calendar_get_calendar_upcoming_view"
+        )
+        events = res["events"]
+        await self.store_events(user_id, events, age=age)
+        return events
+
+    async def load_events(self, member: discord.User, token: str, *, changed=False):
+        """
+        Get upcoming events, from the event store if it's fresh enough.
+
+        Returns None if Moodle returned an error.
+        """
+        events = await self.fetch_stored_events(
+            member.id, max_age=self.event_sync_ttl, changed=changed
+        )
+        if events is not None:
+            return events
+
+        # Fill missing userid with site info in the same round trip
+        userid = (self.users.get(member.id) or {}).get("userid")
+        async with self.moodle.batch(token) as batch:
+            if not userid:
+                site_info = batch.add("core_webservice_get_site_info")
+            res = batch.add("core_calendar_get_calendar_upcoming_view")
+        if not userid:
+            try:
+                self.cache_user(member, token, site_info.result()["userid"])
+            except (KeyError, TypeError):
+                pass
+
+        age = self.moodle.response_age(
+            token, "core_calendar_get_calendar_upcoming_view"
+        )
+        try:
+            await self.store_events(member.id, res.result()["events"], age=age)
+        except (KeyError, TypeError):
+            return None
+        return await self.fetch_stored_events(member.id, changed=changed)
+
+    async def fetch_snapshot(self, user_id: int):
+        """
+        Get user's courses snapshot, returns `(courses, age in seconds)`.
+        """
+        row = await self.conn.fetchrow(
+            """
+            SELECT courses, extract(epoch FROM now() - refreshed_at) AS age
+            FROM elearningbot.snapshot
+            WHERE user_id = $1
+            """,
+            user_id,
+        )
+        if not row:
+            return None, None
+        return json.loads(row["courses"]), row["age"]
+
+    async def fetch_outdated_snapshots(self, max_age, limit) -> list:
+        """
+        Get registered users whose snapshot is missing or older than `max_age`.
+        """
+        rows = await self.conn.fetch(
+            """
+            SELECT token.user_id FROM elearningbot.token AS token
+            LEFT JOIN elearningbot.snapshot AS snapshot
+            ON snapshot.user_id = token.user_id
+            WHERE snapshot.refreshed_at IS NULL
+            OR snapshot.refreshed_at < now() - make_interval(secs => $1)
+            ORDER BY snapshot.refreshed_at NULLS FIRST
+            LIMIT $2
+            """,
+            float(max_age),
+            limit,
+        )
+        return [row["user_id"] for row in rows]
+
+    async def refresh_snapshot(self, user_id: int):
+        """
+        Refresh user's courses snapshot and event store from Moodle.
         """
+        member = discord.Object(id=user_id)
         token = await self.fetch_token(member)
-        return await self.moodle.get_userid(token)
+        if token is None:
+            return
+        userid = await self.fetch_userid(member)
+        courses = await self.moodle.get_enrolled_courses(userid, token)
+        await self.sync_events(user_id, token)
+        await self.conn.execute(
+            """
+            INSERT INTO elearningbot.snapshot (user_id, courses, refreshed_at)
+            VALUES ($1, $2::jsonb, now())
+            ON CONFLICT (user_id) DO UPDATE SET
+                courses = EXCLUDED.courses,
+                refreshed_at = EXCLUDED.refreshed_at
+            """,
+            user_id,
+            json.dumps(courses),
+        )
 
     @commands.command()
     async def register(self, ctx):
@@ -339,14 +1381,9 @@ class Moodle(commands.Cog, name="moodle"):
             )
             return await ctx.author.send(embed=e)
 
-        await self.conn.execute(
-            """
-            INSERT INTO elearningbot.token (user_id, token)
-            VALUES ($1, $2)
-            """,
-            str(ctx.author.id),
-            token,
-        )
+        await self.conn.store_token(ctx.author.id, token)
+        self.cache_user(ctx.author, token, await self.moodle.get_userid(token))
+        self.reminder.add_user(ctx.author.id)
         desc = (
             t_(
                 "Congratulation your token successfully registered!\n\n**Your account information**:\nUsername: `"
@@ -372,6 +1409,94 @@ class Moodle(commands.Cog, name="moodle"):
             )
             await ctx.send(embed=e)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def moodlestatus(self, ctx):
+        """Show Moodle API and reminder status."""
+        stats = self.moodle.breaker.stats()
+        e = discord.Embed(title="Moodle API", colour=discord.Colour.blue())
+        e.add_field(
+            name="Circuit Breaker",
+            value=(
+                f"State: {stats['state']}\n"
+                f"Consecutive failures: {stats['failures']}\n"
+                f"Opened: {stats['opened']} times"
+            ),
+            inline=False,
+        )
+        stats = self.moodle.cache.stats()
+        e.add_field(
+            name="Response Cache",
+            value=(
+                f"Size: {stats['size']}/{stats['maxsize']}\n"
+                f"Hits: {stats['hits']} (+{stats['stale_hits']} stale)\n"
+                f"Misses: {stats['misses']}\n"
+                f"Hit ratio: {stats['hit_ratio']:.1%}"
+            ),
+        )
+        if self.disk_cache is not None:
+            stats = self.disk_cache.stats()
+            e.add_field(
+                name="Disk Cache",
+                value=(
+                    f"Hits: {stats['hits']}\n"
+                    f"Misses: {stats['misses']}\n"
+                    f"Corrupted: {stats['corrupted']}\n"
+                    f"Pending writes: {stats['pending']}"
+                ),
+            )
+        stats = self.moodle.limiter.stats()
+        e.add_field(
+            name="Rate Limiter",
+            value=(
+                f"Rate: {stats['rate']:.2f}/{stats['max_rate']:.2f} req/s\n"
+                f"In-flight: {stats['inflight']}/{stats['max_inflight']}\n"
+                f"Queued: {stats['queued']}\n"
+                f"Backoffs: {stats['backoffs']}"
+            ),
+        )
+        stats = self.conn.stats()
+        e.add_field(
+            name="Database Pool",
+            value=(
+                f"In use: {stats['in_use']}/{stats['max_size']}\n"
+                f"Waiting: {stats['waiting']} (max {stats['max_waiting']})\n"
+                f"Acquire avg/p95/max: {stats['latency_avg'] * 1000:.1f}/"
+                f"{stats['latency_p95'] * 1000:.1f}/"
+                f"{stats['latency_max'] * 1000:.1f} ms"
+            ),
+        )
+        stats = self.reminder.stats()
+        e.add_field(
+            name="Reminder",
+            value=(
+                f"Users: {stats['users']}\n"
+                f"Pending polls: {stats['polls']}\n"
+                f"Pending reminders: {stats['reminders']}\n"
+                f"Sent: {stats['sent']}"
+            ),
+        )
+        stats = self.snapshots.stats()
+        e.add_field(
+            name="Snapshots",
+            value=(
+                f"Queued: {stats['queued']}\n"
+                f"Refreshed: {stats['refreshed']}\n"
+                f"Failed: {stats['failed']}"
+            ),
+        )
+        stats = self.leadership.stats()
+        e.add_field(
+            name="Cluster",
+            value=(
+                f"Shards: {', '.join(map(str, self.bot.shards))}"
+                f"/{self.bot.shard_count}\n"
+                f"Workers leader: {'yes' if stats['leader'] else 'no'}\n"
+                f"Elected: {stats['elections']} times"
+            ),
+        )
+        await ctx.send(embed=e)
+
     @commands.group(invoke_without_command=True, usage="(keyword/option)")
     async def get(self, ctx, *, keyword):
         """Get an information from Moodle, or search for something using Searx."""
@@ -382,13 +1507,26 @@ class Moodle(commands.Cog, name="moodle"):
         """
         Get userid from Moodle.
         """
-        user_id = await self.fetch_userid(ctx.author)
+        try:
+            user_id = await self.fetch_userid(ctx.author)
+        except MoodleUnavailable:
+            return await self.send_unavailable(ctx)
         await ctx.send(
             t_("{0}, your elearning user id is `{1}`").format(
                 ctx.author.mention, user_id
             )
         )
 
+    async def send_unavailable(self, ctx):
+        await ctx.send(t_("Moodle is unreachable right now, please try again later."))
+
+    async def send_stale_notice(self, ctx):
+        """
+        Warn that the data might be outdated if Moodle is unreachable.
+        """
+        if not self.moodle.breaker.is_closed:
+            await ctx.send(t_("Moodle is unreachable right now, showing cached data."))
+
     @get.command(aliases=["fucking_homework", "calendar"])
     async def homework(self, ctx):
         """
@@ -399,28 +1537,108 @@ class Moodle(commands.Cog, name="moodle"):
                 t_("You're not registered, please do `!register` first")
             )
 
-        user_id = await self.fetch_userid(ctx.author)
+        await self.show_events(ctx)
+
+    @get.command()
+    async def changes(self, ctx):
+        """
+        Get upcoming events that changed since you last checked.
+        """
+        if not await self.is_registered(ctx):
+            return await ctx.send(
+                t_("You're not registered, please do `!register` first")
+            )
+
+        await self.show_events(ctx, changed=True)
+
+    async def show_events(self, ctx, *, changed=False):
         token = await self.fetch_token(ctx.author)
-        events = await self.moodle.get_func_json(
-            token, "core_calendar_get_calendar_upcoming_view"
-        )
+        age = None
+        if self.snapshots_enabled:
+            # Answer from the event store, refreshed in background
+            age = await self.event_sync_age(ctx.author.id)
+            if age is not None and age > self.event_sync_ttl:
+                self.snapshots.enqueue(ctx.author.id)
+        try:
+            if age is not None:
+                events = await self.fetch_stored_events(ctx.author.id, changed=changed)
+            else:
+                events = await self.load_events(ctx.author, token, changed=changed)
+        except MoodleUnavailable:
+            # Outdated events are better than nothing
+            events = await self.fetch_stored_events(ctx.author.id, changed=changed)
+            if events is None:
+                return await self.send_unavailable(ctx)
+
+        if events is None:
+            return await ctx.send(
+                "Bot failed to get the homeworks, it might be that the site is down."
+            )
+        if not events:
+            if changed:
+                return await ctx.send(t_("Nothing changed since you last checked."))
+            return await ctx.send(t_("No upcoming events."))
 
+        await self.mark_events_seen(ctx.author.id)
+        menu = ziPages(MoodleEventsPageSource(ctx, events, age=age))
+        await self.send_stale_notice(ctx)
+        await menu.start(ctx)
+
+    @get.command(usage="[ongoing/current/all]")
+    async def courses(self, ctx, option: str = "ongoing"):
+        """
+        Get list of all available courses
+        """
         try:
-            menu = ziPages(MoodleEventsPageSource(ctx, events["events"]))
-            await menu.start(ctx)
+            filters = COURSE_FILTERS[option.lower()]
         except KeyError:
-            await ctx.send("Bot failed to get the homeworks, it might be that the site is down.")
+            return await ctx.send(
+                f"Usage: `{ctx.prefix}{ctx.command.qualified_name} {ctx.command.signature}`"
+            )
+
+        if self.snapshots_enabled and option.lower() != "all":
+            # Answer from the snapshot, refreshed in background
+            courses, age = await self.fetch_snapshot(ctx.author.id)
+            if courses is not None:
+                if age > self.snapshots.max_age:
+                    self.snapshots.enqueue(ctx.author.id)
+                courses = [
+                    course
+                    for course in courses
+                    if all(check(course) for check in filters)
+                ]
+                menu = ziPages(MoodleCoursesPageSource(ctx, courses, age=age))
+                return await menu.start(ctx)
+            self.snapshots.enqueue(ctx.author.id)
+
+        try:
+            user_id = await self.fetch_userid(ctx.author)
+            token = await self.fetch_token(ctx.author)
+            # First page is shown while the rest are still loading
+            courses = self.moodle.iter_enrolled_courses(user_id, token, filters=filters)
+            menu = ziPages(MoodleCoursesPageSource(ctx, courses))
+            await self.send_stale_notice(ctx)
+            await menu.start(ctx)
+        except MoodleUnavailable:
+            return await self.send_unavailable(ctx)
 
     @get.command()
-    async def courses(self, ctx):
+    async def refresh(self, ctx):
         """
-        Get list of all available courses
+        Refresh your courses and upcoming events.
         """
-        user_id = await self.fetch_userid(ctx.author)
-        token = await self.fetch_token(ctx.author)
-        courses = await self.moodle.get_enrolled_courses(user_id, token)
-        menu = ziPages(MoodleCoursesPageSource(ctx, courses))
-        await menu.start(ctx)
+        if not await self.is_registered(ctx):
+            return await ctx.send(
+                t_("You're not registered, please do `!register` first")
+            )
+
+        self.moodle.forget(await self.fetch_token(ctx.author))
+        try:
+            async with ctx.typing():
+                await self.refresh_snapshot(ctx.author.id)
+        except MoodleUnavailable:
+            return await self.send_unavailable(ctx)
+        await ctx.send(t_("Your courses and upcoming events are up to date!"))
 
 
 def setup(bot):
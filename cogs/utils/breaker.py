@@ -0,0 +1,91 @@
+import logging
+import time
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker, stops requests to a service that keeps failing.
+
+    Opens after `threshold` consecutive failures, requests fail fast while
+    open. After `reset_timeout` seconds it goes half-open and lets up to
+    `probes` requests through, closing again if they succeed or re-opening
+    if they fail.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, *, threshold=5, reset_timeout=30.0, probes=1):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.logger = logging.getLogger("discord")
+
+        self.failures = 0
+        self.opened = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == self.CLOSED
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self.logger.warning(
+            f"Circuit breaker '{self.name}' changed from {self._state} to {state}"
+        )
+        self._state = state
+        self._probing = 0
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self.opened += 1
+
+    def allow(self) -> bool:
+        """
+        Check whether a request may go through, call `record` when it's done.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probing < self.probes:
+            self._probing += 1
+            return True
+        return False
+
+    def record(self, failed):
+        """
+        Record result of an allowed request.
+
+        `failed` is None if the request didn't finish (e.g. cancelled).
+        """
+        if self._state == self.HALF_OPEN:
+            self._probing = max(0, self._probing - 1)
+
+        if failed:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.threshold:
+                self._set_state(self.OPEN)
+        elif failed is not None:
+            self.failures = 0
+            self._set_state(self.CLOSED)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+        }
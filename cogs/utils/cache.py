@@ -0,0 +1,135 @@
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size bounded mapping, evicts the least recently used key when full.
+
+    Entries expire `ttl` seconds after they're set (never if `ttl` is None).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def get(self, key, default=None):
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            return default
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        try:
+            return self._data.pop(key)[0]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+
+class ResponseCache:
+    """
+    Cache for webservice responses with stale-while-revalidate.
+
+    Entries are fresh for their function's TTL, after that they're served as
+    stale for another `stale_ttl` seconds (while the caller refreshes them)
+    before being dropped. Functions with TTL of 0 are never cached.
+    """
+
+    def __init__(self, maxsize=2048, *, ttls=None, default_ttl=60, stale_ttl=600):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._data = LRUCache(maxsize=maxsize)
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def ttl_for(self, function: str) -> int:
+        return self.ttls.get(function, self.default_ttl)
+
+    def get(self, key, function: str):
+        """
+        Returns `(value, state)`, state is "fresh", "stale" or None on miss.
+        """
+        cached = self._data.get(key)
+        if cached is None:
+            self.misses += 1
+            return None, None
+
+        value, stored_at = cached
+        if time.monotonic() - stored_at < self.ttl_for(function):
+            self.hits += 1
+            return value, "fresh"
+        self.stale_hits += 1
+        return value, "stale"
+
+    def set(self, key, function: str, value, *, age=0):
+        """
+        Cache value, `age` is how many seconds ago it was fetched.
+        """
+        ttl = self.ttl_for(function)
+        if ttl <= 0 or age >= ttl + self.stale_ttl:
+            return
+        self._data.set(
+            key, (value, time.monotonic() - age), ttl=ttl + self.stale_ttl - age
+        )
+
+    def age(self, key):
+        """
+        Seconds since the cached value was fetched, None if it's not cached.
+        """
+        cached = self._data.get(key)
+        if cached is None:
+            return None
+        return time.monotonic() - cached[1]
+
+    def keys(self):
+        return self._data.keys()
+
+    def pop(self, key):
+        return self._data.pop(key)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self._data.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0,
+        }
@@ -0,0 +1,238 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+
+class DiskCache:
+    """
+    Persistent key-value cache backed by SQLite, so restarts start warm.
+
+    Values must be JSON serializable, they're stored compressed with a checksum
+    that's verified on read. Reads run in a background thread, writes are
+    queued and flushed every `flush_interval` seconds (write-behind). Least
+    recently used entries are evicted once the cache is bigger than
+    `max_size` bytes, entries older than `max_age` seconds are dropped.
+    """
+
+    def __init__(
+        self, path, *, max_size=64 * 1024 * 1024, max_age=86400, flush_interval=5.0
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger("discord")
+
+        self.hits = 0
+        self.misses = 0
+        self.corrupted = 0
+        self._db = None
+        self._pending = {}
+        self._task = None
+        self._closed = False
+        # SQLite connection is only used from this thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def make_key(key) -> str:
+        # Hashed, keys may contain tokens
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        if db.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise sqlite3.DatabaseError("quick_check failed")
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                checksum TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at_idx ON entries (accessed_at)"
+        )
+        db.execute(
+            "DELETE FROM entries WHERE stored_at < ?", (time.time() - self.max_age,)
+        )
+        db.commit()
+        return db
+
+    def _open(self):
+        try:
+            self._db = self._connect()
+        except sqlite3.OperationalError as e:
+            # e.g. locked by another process sharing the file, not corrupted
+            self.logger.warning(f"Failed to open disk cache {self.path}: {e!r}")
+            return
+        except sqlite3.DatabaseError as e:
+            self.logger.warning(
+                f"Disk cache {self.path} is corrupted, resetting: {e!r}"
+            )
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+            self._db = self._connect()
+
+    async def open(self):
+        if self._closed:
+            return
+        await self._run(self._open)
+        if self._closed:
+            return
+        self._task = asyncio.ensure_future(self._flush_loop())
+
+    def close(self):
+        """
+        Flush pending writes and close the database.
+
+        Blocks until it's done, so writes aren't lost on shutdown.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Runs after opening if it's still in progress
+        self._executor.submit(self._close).result()
+        self._executor.shutdown()
+
+    def _close(self):
+        if self._db is None:
+            return
+        pending, self._pending = self._pending, {}
+        if pending:
+            self._write(pending)
+        self._db.close()
+        self._db = None
+
+    def _get(self, key):
+        row = self._db.execute(
+            "SELECT value, checksum, stored_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, checksum, stored_at = row
+        try:
+            if hashlib.sha256(value).hexdigest() != checksum:
+                raise ValueError("checksum mismatch")
+            value = json.loads(zlib.decompress(value))
+        except (ValueError, zlib.error):
+            self.corrupted += 1
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+
+        self._db.execute(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        self._db.commit()
+        return value, time.time() - stored_at
+
+    async def get(self, key):
+        """
+        Returns `(value, age in seconds)`, or None if it's not cached.
+        """
+        if self._db is None:
+            return None
+        key = self.make_key(key)
+        if key in self._pending:
+            self.hits += 1
+            value, stored_at = self._pending[key]
+            return value, time.time() - stored_at
+
+        try:
+            res = await self._run(self._get, key)
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to read disk cache: {e!r}")
+            res = None
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return res
+
+    def set(self, key, value):
+        """
+        Queue value to be written on next flush.
+        """
+        if self._db is not None:
+            self._pending[self.make_key(key)] = (value, time.time())
+
+    def _write(self, pending):
+        now = time.time()
+        rows = []
+        for key, (value, stored_at) in pending.items():
+            value = zlib.compress(json.dumps(value).encode())
+            rows.append(
+                (
+                    key,
+                    value,
+                    hashlib.sha256(value).hexdigest(),
+                    len(value),
+                    stored_at,
+                    now,
+                )
+            )
+        self._db.executemany(
+            """
+            INSERT OR REPLACE INTO entries
+                (key, value, checksum, size, stored_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        # Keep the most recently used entries that fit in max_size
+        self._db.execute(
+            """
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS total
+                    FROM entries
+                ) WHERE total > ?
+            )
+            """,
+            (self.max_size,),
+        )
+        self._db.commit()
+
+    async def flush(self):
+        if not self._pending or self._db is None:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self._run(self._write, pending)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.logger.warning(f"Failed to write disk cache: {e!r}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "corrupted": self.corrupted,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,262 @@
+import asyncio
+import collections
+import concurrent.futures
+import gzip
+import json
+import logging
+import re
+import time
+
+SCRUBBED = "<scrubbed>"
+# Keys whose values are credentials (or identify the student), in params and
+# responses
+SECRET_KEYS = {
+    "token",
+    "privatetoken",
+    "wstoken",
+    "password",
+    "userprivateaccesskey",
+    "username",
+}
+BATCH_FUNCTION = "tool_mobile_call_external_functions"
+# Tokens embedded in URLs, e.g. pluginfile.php links
+URL_TOKEN = re.compile(r"([?&](?:ws)?token=)[^&\"'\s]+")
+
+
+def scrub(value):
+    """
+    Replace credentials in a JSON-like value with `SCRUBBED`.
+    """
+    if isinstance(value, dict):
+        return {
+            key: SCRUBBED if key in SECRET_KEYS else scrub(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    if isinstance(value, str):
+        return URL_TOKEN.sub(r"\1" + SCRUBBED, value)
+    return value
+
+
+def fixture_key(function: str, params: dict) -> str:
+    return json.dumps([function, sorted(params.items())])
+
+
+class FixtureRecorder:
+    """
+    Records Moodle responses to a gzip compressed JSON lines file.
+
+    Each line holds the function, its params, the response and how long it
+    took. Credentials and usernames are scrubbed, but responses still hold
+    names and course data, review the files before sharing them.
+
+    Lines are buffered and written by a background thread once `batch_size`
+    are buffered or `flush_interval` seconds passed, so compressing and
+    writing doesn't block the event loop.
+    """
+
+    def __init__(self, path, *, batch_size=100, flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+        # Appending adds a gzip member, readers handle multiple members
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        # Writes in order, the file is only used from this thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def record(self, function: str, params: dict, res, elapsed: float, *, token=None):
+        if self._file is None:
+            return
+        line = json.dumps(
+            {
+                "function": function,
+                "params": scrub({key: str(value) for key, value in params.items()}),
+                "response": scrub(res),
+                "elapsed": round(elapsed, 6),
+            }
+        )
+        if token:
+            # Wherever else it shows up
+            line = line.replace(token, SCRUBBED)
+        self._buffer.append(line + "\n")
+        self.recorded += 1
+        if (
+            len(self._buffer) >= self.batch_size
+            or time.monotonic() - self._flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        self._flushed_at = time.monotonic()
+        self._executor.submit(self._file.writelines, lines)
+
+    def close(self):
+        """
+        Write buffered lines and close the file, blocks until it's done.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._executor.submit(self._file.close).result()
+        self._executor.shutdown()
+        self._file = None
+
+
+class FixtureReplayer:
+    """
+    Serves responses recorded by `FixtureRecorder`, with their original timing.
+
+    Requests are matched by function and params (tokens are ignored), falling
+    back to any response of the same function. Responses to the same request
+    are served in recorded order, the last one is repeated. `speed` scales
+    the recorded response times, 0 answers right away.
+
+    Batched calls are never answered with another batch's responses, recorded
+    batches are also unpacked into their calls, and a batch that wasn't
+    recorded as is gets assembled from the responses of its calls.
+    """
+
+    def __init__(self, path, *, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.logger = logging.getLogger("discord")
+
+        self.served = 0
+        self.missing = 0
+        # {fixture key: deque of entries}, {function: deque of entries}
+        self._requests = collections.defaultdict(collections.deque)
+        self._functions = collections.defaultdict(collections.deque)
+        self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._add(entry)
+                if entry["function"] == BATCH_FUNCTION:
+                    for call in self._unpack(entry):
+                        self._add(call)
+        self.logger.info(
+            f"Loaded {sum(map(len, self._requests.values()))} Moodle responses "
+            f"from {self.path}"
+        )
+
+    def _add(self, entry):
+        key = fixture_key(entry["function"], entry["params"])
+        self._requests[key].append(entry)
+        self._functions[entry["function"]].append(entry)
+
+    @staticmethod
+    def _calls(params: dict) -> list:
+        """
+        Returns `[(function, params)]` of a batch request's params.
+        """
+        calls = []
+        i = 0
+        while f"requests[{i}][function]" in params:
+            arguments = params.get(f"requests[{i}][arguments]") or "{}"
+            calls.append((params[f"requests[{i}][function]"], json.loads(arguments)))
+            i += 1
+        return calls
+
+    def _unpack(self, entry) -> list:
+        try:
+            responses = entry["response"]["responses"]
+        except (KeyError, TypeError):
+            return []
+        calls = []
+        for (function, params), response in zip(
+            self._calls(entry["params"]), responses
+        ):
+            if response["error"]:
+                res = json.loads(response["exception"])
+            else:
+                res = json.loads(response["data"] or "null")
+            calls.append(
+                {
+                    "function": function,
+                    "params": params,
+                    "response": res,
+                    "elapsed": entry["elapsed"],
+                }
+            )
+        return calls
+
+    @staticmethod
+    def _next(entries):
+        if len(entries) > 1:
+            return entries.popleft()
+        return entries[0]
+
+    def lookup(self, function: str, params: dict):
+        """
+        Returns the recorded entry for a request, or None.
+        """
+        params = scrub({key: str(value) for key, value in params.items()})
+        entries = self._requests.get(fixture_key(function, params))
+        if entries:
+            return self._next(entries)
+        if function == BATCH_FUNCTION:
+            return self._assemble(params)
+        entries = self._functions.get(function)
+        if entries:
+            return self._next(entries)
+        return None
+
+    def _assemble(self, params: dict):
+        """
+        Build a batch's response from the recorded responses of its calls.
+        """
+        calls = self._calls(params)
+        responses = []
+        elapsed = 0.0
+        for function, arguments in calls:
+            entry = self.lookup(function, arguments)
+            if entry is None:
+                self.missing += 1
+                self.logger.warning(f"No recorded response for {function}")
+                responses.append(
+                    {
+                        "error": True,
+                        "exception": json.dumps(self.missing_error(function)),
+                    }
+                )
+                continue
+            elapsed = max(elapsed, entry["elapsed"])
+            res = entry["response"]
+            if isinstance(res, dict) and "exception" in res:
+                responses.append({"error": True, "exception": json.dumps(res)})
+            else:
+                responses.append({"error": False, "data": json.dumps(res)})
+        if not calls:
+            return None
+        return {"response": {"responses": responses}, "elapsed": elapsed}
+
+    @staticmethod
+    def missing_error(function: str) -> dict:
+        # Same shape as Moodle's errors
+        return {
+            "exception": "moodle_exception",
+            "errorcode": "fixturemissing",
+            "message": f"No recorded response for {function}.",
+        }
+
+    async def replay(self, function: str, params: dict):
+        entry = self.lookup(function, params)
+        if entry is None:
+            self.missing += 1
+            self.logger.warning(f"No recorded response for {function}")
+            return self.missing_error(function)
+        self.served += 1
+        if self.speed:
+            await asyncio.sleep(entry["elapsed"] * self.speed)
+        return entry["response"]
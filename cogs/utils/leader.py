@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+
+class Leadership:
+    """
+    Leader election across processes sharing the database.
+
+    Only 1 process at a time holds the session-level advisory lock `key`.
+    `on_elected` is called when this process takes the lock and `on_demoted`
+    when it loses it (e.g. its connection died), non-leaders retry every
+    `interval` seconds.
+    """
+
+    def __init__(self, bot, key: int, *, on_elected, on_demoted, interval=30.0):
+        self.bot = bot
+        self.key = key
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval
+        self.logger = logging.getLogger("discord")
+
+        self.elections = 0
+        self._conn = None
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._conn is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._conn is not None:
+            self.on_demoted()
+            # Releasing the connection resets it, which releases the lock
+            self.bot.loop.create_task(self.bot.pool.release(self._conn))
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {"leader": self.is_leader, "elections": self.elections}
+
+    async def run(self):
+        while True:
+            try:
+                if self._conn is None:
+                    await self.campaign()
+                else:
+                    await self.check()
+            except Exception as e:
+                self.logger.warning(f"Leader election failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    async def campaign(self):
+        conn = await self.bot.pool.acquire()
+        elected = False
+        try:
+            elected = await conn.fetchval("SELECT pg_try_advisory_lock($1)", self.key)
+        finally:
+            if not elected:
+                await self.bot.pool.release(conn)
+        if not elected:
+            return
+
+        self._conn = conn
+        self.elections += 1
+        self.logger.warning("Elected as leader of background workers")
+        self.on_elected()
+
+    async def check(self):
+        try:
+            await self._conn.fetchval("SELECT 1")
+        except Exception as e:
+            # The lock is gone along with the session
+            self.logger.warning(f"Lost leadership of background workers: {e!r}")
+            conn, self._conn = self._conn, None
+            self.on_demoted()
+            try:
+                await self.bot.pool.release(conn)
+            except Exception:
+                pass
@@ -0,0 +1,83 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag and samples the stack of code blocking the loop.
+
+    A task wakes up every `interval` seconds and records how late it woke up
+    (the lag). A watchdog thread checks that the task keeps ticking, once the
+    loop has been blocked for `threshold` seconds it captures the loop
+    thread's stack, so the blocking code shows up in the log.
+    """
+
+    def __init__(self, bot, *, interval=0.5, threshold=0.25, samples=20):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = threshold
+        self.logger = logging.getLogger("discord")
+
+        self.max_lag = 0.0
+        # [(time, seconds blocked when sampled, stack)], latest stalls
+        self.stalls = collections.deque(maxlen=samples)
+        self._tick = time.monotonic()
+        self._thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Start monitoring, must be called from the loop's thread.
+        """
+        if self._task is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._tick = time.monotonic()
+        self._stop.clear()
+        self._task = self.bot.loop.create_task(self.run())
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {"max_lag": self.max_lag, "stalls": len(self.stalls)}
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._tick = time.monotonic()
+            lag = max(0.0, self._tick - start - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            self.bot.metrics.observe("loop", "lag", lag)
+            if lag >= self.threshold:
+                self.logger.warning(f"Event loop was blocked for {lag:.3f}s")
+
+    def watch(self):
+        sampled = None
+        while not self._stop.wait(self.threshold / 2):
+            tick = self._tick
+            blocked = time.monotonic() - tick - self.interval
+            if blocked < self.threshold or tick == sampled:
+                continue
+
+            # Once per stall
+            sampled = tick
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame)[-15:])
+            self.stalls.append((time.time(), blocked, stack))
+            self.logger.warning(
+                f"Event loop blocked for {blocked:.3f}s so far, at:\n{stack}"
+            )
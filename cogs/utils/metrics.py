@@ -0,0 +1,115 @@
+import bisect
+import contextlib
+import time
+
+LATENCY = "elearningbot_latency_seconds"
+ERRORS = "elearningbot_errors_total"
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets (in seconds).
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # Last one is for values above the biggest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate quantile, as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Latency histograms and error counts, keyed by kind (e.g. "command",
+    "wsfunction", "db", "discord") and name.
+    """
+
+    def __init__(self):
+        # {(kind, name): Histogram}
+        self.histograms = {}
+
+    def get(self, kind: str, name: str) -> Histogram:
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = self.histograms[(kind, name)] = Histogram()
+        return histogram
+
+    def observe(self, kind: str, name: str, seconds: float):
+        self.get(kind, name).observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, kind: str, name: str):
+        """
+        Time the block, exceptions are counted as errors.
+        """
+        histogram = self.get(kind, name)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            histogram.errors += 1
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def summary(self, kind: str = None) -> list:
+        """
+        Returns `[(kind, name, histogram)]` sorted by total time spent.
+        """
+        rows = [
+            (key[0], key[1], histogram)
+            for key, histogram in self.histograms.items()
+            if kind is None or key[0] == kind
+        ]
+        return sorted(rows, key=lambda row: row[2].sum, reverse=True)
+
+    def prometheus(self) -> str:
+        """
+        Export in Prometheus text format.
+        """
+
+        def label(value):
+            value = value.replace("\\", "\\\\").replace('"', '\\"')
+            return value.replace("\n", "\\n")
+
+        lines = [
+            f"# HELP {LATENCY} Latency of commands, Moodle webservice functions, "
+            "database queries and Discord API calls.",
+            f"# TYPE {LATENCY} histogram",
+        ]
+        errors = [f"# HELP {ERRORS} Failed calls.", f"# TYPE {ERRORS} counter"]
+        for (kind, name), histogram in sorted(self.histograms.items()):
+            labels = f'kind="{label(kind)}",name="{label(name)}"'
+            total = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                total += count
+                lines.append(f'{LATENCY}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"{LATENCY}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{LATENCY}_count{{{labels}}} {histogram.count}")
+            errors.append(f"{ERRORS}{{{labels}}} {histogram.errors}")
+        return "\n".join(lines + errors) + "\n"
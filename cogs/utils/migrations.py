@@ -0,0 +1,140 @@
+import logging
+
+
+# (version, description, SQL), applied in order and only once. Never edit a
+# released migration, add a new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "Initial schema",
+        """
+        CREATE TABLE IF NOT EXISTS elearningbot.token (user_id text, token text);
+
+        -- Notify listeners (e.g. the moodle cog's user cache) on token changes
+        CREATE OR REPLACE FUNCTION elearningbot.notify_token_change()
+        RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('elearningbot_token', OLD.user_id::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS token_change ON elearningbot.token;
+        CREATE TRIGGER token_change
+        AFTER UPDATE OR DELETE ON elearningbot.token
+        FOR EACH ROW EXECUTE PROCEDURE elearningbot.notify_token_change();
+
+        -- Local copy of users' upcoming events, see Moodle.store_events
+        CREATE TABLE IF NOT EXISTS elearningbot.event (
+            user_id bigint NOT NULL,
+            event_id bigint NOT NULL,
+            timemodified bigint NOT NULL,
+            timesort bigint NOT NULL,
+            data jsonb NOT NULL,
+            content text,
+            updated_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, event_id)
+        );
+        CREATE INDEX IF NOT EXISTS event_user_id_timesort_idx
+        ON elearningbot.event (user_id, timesort);
+
+        CREATE TABLE IF NOT EXISTS elearningbot.event_sync (
+            user_id bigint PRIMARY KEY,
+            synced_at timestamptz NOT NULL,
+            seen_at timestamptz
+        );
+
+        -- Users' courses, refreshed in background, see Moodle.refresh_snapshot
+        CREATE TABLE IF NOT EXISTS elearningbot.snapshot (
+            user_id bigint PRIMARY KEY,
+            courses jsonb NOT NULL,
+            refreshed_at timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS snapshot_refreshed_at_idx
+        ON elearningbot.snapshot (refreshed_at);
+        """,
+    ),
+    (
+        2,
+        "Key token by bigint user id",
+        """
+        -- Drop rows that can't be keyed, then duplicates (keeping the newest)
+        DELETE FROM elearningbot.token
+        WHERE user_id IS NULL OR user_id !~ '^[0-9]+$' OR token IS NULL;
+
+        DELETE FROM elearningbot.token AS a
+        USING elearningbot.token AS b
+        WHERE a.user_id = b.user_id AND a.ctid < b.ctid;
+
+        ALTER TABLE elearningbot.token
+            ALTER COLUMN user_id TYPE bigint USING user_id::bigint,
+            ALTER COLUMN user_id SET NOT NULL,
+            ALTER COLUMN token SET NOT NULL,
+            ADD PRIMARY KEY (user_id);
+        """,
+    ),
+    (
+        3,
+        "Notify on token inserts",
+        """
+        -- Lets every process know about users registered in another process
+        CREATE OR REPLACE FUNCTION elearningbot.notify_token_change()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify('elearningbot_token', NEW.user_id::text);
+            ELSE
+                PERFORM pg_notify('elearningbot_token', OLD.user_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS token_change ON elearningbot.token;
+        CREATE TRIGGER token_change
+        AFTER INSERT OR UPDATE OR DELETE ON elearningbot.token
+        FOR EACH ROW EXECUTE PROCEDURE elearningbot.notify_token_change();
+        """,
+    ),
+]
+
+# Serializes migrations of bots sharing a database
+LOCK_ID = 0x656C6561726E
+
+
+async def migrate(pool):
+    """
+    Apply pending migrations, returns the schema version.
+    """
+    logger = logging.getLogger("discord")
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", LOCK_ID)
+            await conn.execute(
+                """
+                CREATE SCHEMA IF NOT EXISTS elearningbot;
+                CREATE TABLE IF NOT EXISTS elearningbot.schema_version (
+                    version integer PRIMARY KEY,
+                    description text NOT NULL,
+                    applied_at timestamptz NOT NULL DEFAULT now()
+                );
+                """
+            )
+            current = await conn.fetchval(
+                "SELECT coalesce(max(version), 0) FROM elearningbot.schema_version"
+            )
+            for version, description, sql in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                await conn.execute(sql)
+                await conn.execute(
+                    """
+                    INSERT INTO elearningbot.schema_version (version, description)
+                    VALUES ($1, $2)
+                    """,
+                    version,
+                    description,
+                )
+                current = version
+    return current
@@ -7,6 +7,11 @@ class ziPages(menus.MenuPages):
     def __init__(self, source):
         super().__init__(source=source, check_embeds=True)
 
+    async def start(self, ctx, *, channel=None, wait=False):
+        if isinstance(self._source, StreamPageSource):
+            self._source.menu = self
+        await super().start(ctx, channel=channel, wait=wait)
+
     async def finalize(self, timed_out):
         try:
             await self.message.clear_reactions()
@@ -124,3 +129,72 @@ class SimplePages(ziPages):
     def __init__(self, entries, *, per_page=12):
         super().__init__(SimplePageSource(entries, per_page=per_page))
         self.embed = discord.Embed(colour=discord.Colour.blurple())
+
+
+class StreamPageSource(menus.PageSource):
+    """A page source backed by an async iterator, 1 entry per page.
+
+    Entries are consumed in background so pages are shown as soon as they're
+    available, :meth:`get_max_pages` returns None until the iterator is
+    exhausted. A list can be passed instead when all entries are known.
+    Page 0 of an empty source is None.
+    """
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.entries = []
+        self.done = False
+        if isinstance(iterator, list):
+            self.entries = iterator
+            self.done = True
+        self.error = None
+        self.menu = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def _notify(self):
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    async def _consume(self):
+        try:
+            async for entry in self.iterator:
+                self.entries.append(entry)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+        # Update the page counter now that it's known
+        if self.menu is not None and self.menu.message is not None:
+            try:
+                await self.menu.show_page(self.menu.current_page)
+            except discord.HTTPException:
+                pass
+
+    async def _wait_for(self, index):
+        while len(self.entries) <= index and not self.done:
+            await self._changed.wait()
+
+    async def prepare(self):
+        if self.done:
+            return
+        self._task = asyncio.ensure_future(self._consume())
+        await self._wait_for(0)
+        if not self.entries and self.error is not None:
+            raise self.error
+
+    def is_paginating(self):
+        return not self.done or len(self.entries) > 1
+
+    def get_max_pages(self):
+        return len(self.entries) if self.done else None
+
+    async def get_page(self, page_number):
+        await self._wait_for(page_number)
+        if page_number == 0 and not self.entries:
+            return None
+        if page_number >= len(self.entries):
+            raise IndexError(page_number)
+        return self.entries[page_number]
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from collections import OrderedDict, deque
+
+
+class HostRateLimiter:
+    """
+    Rate limiter for requests to a single host.
+
+    Combines a token bucket (`rate` requests per second, bursting up to
+    `burst`), a cap on in-flight requests and round-robin queueing across
+    users, so 1 user can't starve the others. The rate backs off
+    multiplicatively on failures (5xx/timeouts) and recovers additively on
+    successes.
+    """
+
+    def __init__(self, rate=10.0, *, burst=20, max_inflight=16, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+
+        self.inflight = 0
+        self.backoffs = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        # {user: deque of waiting futures}, ordered by whose turn it is
+        self._queues = OrderedDict()
+        self._timer = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _can_grant(self) -> bool:
+        self._refill()
+        return self.inflight < self.max_inflight and self._tokens >= 1
+
+    def _grant(self):
+        self.inflight += 1
+        self._tokens -= 1
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues and self._can_grant():
+            user, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                # Back of the line for this user's next request
+                self._queues[user] = queue
+            if future.done():
+                # Cancelled while waiting
+                continue
+            self._grant()
+            future.set_result(None)
+
+        if self._queues and self._timer is None and self.inflight < self.max_inflight:
+            # Out of tokens, wake up once there's 1 available
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_event_loop().call_later(delay, self._dispatch)
+
+    async def acquire(self, user=None):
+        """
+        Wait for a request slot, `user` is used to queue fairly.
+        """
+        if not self._queues and self._can_grant():
+            self._grant()
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted right before being cancelled
+                self.release()
+            else:
+                queue = self._queues.get(user)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._queues[user]
+            raise
+
+    def release(self, *, failed=None):
+        """
+        Release a request slot.
+
+        `failed` reports whether the request failed (True) or succeeded
+        (False) to adapt the rate, None leaves the rate as it is.
+        """
+        self.inflight -= 1
+        if failed:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.backoffs += 1
+        elif failed is not None:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "max_rate": self.max_rate,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "queued": self.queued,
+            "backoffs": self.backoffs,
+        }
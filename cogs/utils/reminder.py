@@ -0,0 +1,212 @@
+import asyncio
+import discord
+import heapq
+import logging
+import random
+import time
+
+from datetime import datetime
+from pytz import timezone
+
+
+class DeadlineReminder:
+    """
+    Background scheduler that DMs users before their Moodle deadlines.
+
+    Keeps 2 heaps, polls ordered by when each user's calendar should be polled
+    next and reminders ordered by when they should be sent. Users are polled
+    more often the nearer their next deadline is, with jitter so polls don't
+    line up, and no more than `concurrency` polls run at once.
+    """
+
+    def __init__(
+        self,
+        cog,
+        *,
+        lead_times=(86400, 3600),
+        concurrency=4,
+        min_interval=600,
+        max_interval=21600,
+        jitter=0.1,
+    ):
+        self.cog = cog
+        self.bot = cog.bot
+        self.logger = logging.getLogger("discord")
+        self.lead_times = sorted(lead_times, reverse=True)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        # [(poll at, user id)]
+        self._polls = []
+        self._users = set()
+        # [(remind at, user id, event id, timesort, lead)]
+        self._reminders = []
+        # {(user id, event id, timesort, lead)}, scheduled and sent reminders
+        self._scheduled = set()
+        self._sent = set()
+        # Reminders actually delivered
+        self.sent = 0
+        # {user id: {event id: event}}, latest polled events
+        self._events = {}
+
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "polls": len(self._polls),
+            "reminders": len(self._reminders),
+            "sent": self.sent,
+        }
+
+    def add_user(self, user_id: int, delay=0):
+        """
+        Schedule user's calendar to be polled after `delay` seconds.
+        """
+        if self._task is None or user_id in self._users:
+            return
+        self._users.add(user_id)
+        heapq.heappush(self._polls, (time.time() + delay, user_id))
+        self._wakeup.set()
+
+    def remove_user(self, user_id: int):
+        # Lazily removed from the heaps
+        self._users.discard(user_id)
+        self._events.pop(user_id, None)
+
+    async def load_users(self):
+        for user_id in await self.cog.conn.fetch_user_ids():
+            # Spread initial polls so they don't all happen at once
+            self.add_user(user_id, random.uniform(0, self.min_interval))
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        await self.load_users()
+        pruned_at = time.time()
+        while True:
+            now = time.time()
+
+            if now - pruned_at > self.min_interval:
+                # Forget reminders of past deadlines
+                self._sent = {key for key in self._sent if key[2] > now}
+                pruned_at = now
+
+            while self._polls and self._polls[0][0] <= now:
+                _, user_id = heapq.heappop(self._polls)
+                if user_id in self._users:
+                    self.bot.loop.create_task(self.poll(user_id))
+
+            while self._reminders and self._reminders[0][0] <= now:
+                reminder = heapq.heappop(self._reminders)
+                self.bot.loop.create_task(self.remind(*reminder[1:]))
+
+            wake_at = min(
+                [now + 60]
+                + [heap[0][0] for heap in (self._polls, self._reminders) if heap]
+            )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def next_interval(self, events) -> float:
+        """
+        Poll interval based on how near the next deadline is.
+        """
+        now = time.time()
+        upcoming = [event["timesort"] - now for event in events]
+        upcoming = [delta for delta in upcoming if delta > 0]
+        if upcoming:
+            interval = min(upcoming) / 4
+        else:
+            interval = self.max_interval
+        interval = max(self.min_interval, min(self.max_interval, interval))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def poll(self, user_id: int):
+        interval = self.max_interval
+        try:
+            async with self._semaphore:
+                token = await self.cog.fetch_token(discord.Object(id=user_id))
+                if token is None:
+                    return self.remove_user(user_id)
+                events = await self.cog.sync_events(user_id, token)
+        except Exception as e:
+            self.logger.warning(f"Failed to poll calendar of user {user_id}: {e!r}")
+        else:
+            self.schedule(user_id, events)
+            interval = self.next_interval(events)
+        finally:
+            if user_id in self._users:
+                heapq.heappush(self._polls, (time.time() + interval, user_id))
+
+    def schedule(self, user_id: int, events):
+        """
+        Schedule reminders of user's events.
+        """
+        now = time.time()
+        self._events[user_id] = {event["id"]: event for event in events}
+        for event in events:
+            timesort = event["timesort"]
+            if timesort <= now:
+                continue
+
+            # Only the nearest lead time that already passed is reminded
+            overdue = [lead for lead in self.lead_times if timesort - lead <= now]
+            for lead in self.lead_times:
+                key = (user_id, event["id"], timesort, lead)
+                if key in self._scheduled or key in self._sent:
+                    continue
+                if lead in overdue and lead != overdue[-1]:
+                    self._sent.add(key)
+                    continue
+                self._scheduled.add(key)
+                heapq.heappush(
+                    self._reminders,
+                    (max(now, timesort - lead), user_id, event["id"], timesort, lead),
+                )
+        self._wakeup.set()
+
+    async def remind(self, user_id: int, event_id: int, timesort: int, lead: int):
+        key = (user_id, event_id, timesort, lead)
+        self._scheduled.discard(key)
+        event = self._events.get(user_id, {}).get(event_id)
+        if event is None or event["timesort"] != timesort or key in self._sent:
+            # Event got removed or its deadline changed
+            return
+        self._sent.add(key)
+
+        t_ = self.bot._
+        e = discord.Embed(
+            title=str(event["name"]),
+            url=event.get("url"),
+            description=t_("Due {0}").format(
+                datetime.fromtimestamp(timesort, timezone("Asia/Jakarta")).strftime(
+                    "%A, %-d %B %Y, %H:%M"
+                )
+            ),
+            colour=discord.Colour.blue(),
+        )
+        try:
+            e.set_author(name=event["course"]["fullname"])
+        except KeyError:
+            pass
+        try:
+            user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+            await user.send(embed=e)
+            self.sent += 1
+        except discord.HTTPException:
+            pass
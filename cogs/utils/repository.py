@@ -0,0 +1,130 @@
+import collections
+import contextlib
+import re
+import time
+
+
+QUERY_NAME = re.compile(
+    r"\s*(SELECT|INSERT INTO|UPDATE|DELETE FROM)\b.*?\belearningbot\.(\w+)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def query_name(query: str) -> str:
+    """
+    Short name of a query for metrics, e.g. "SELECT token".
+    """
+    match = QUERY_NAME.match(query)
+    if match:
+        return f"{match[1].upper()} {match[2]}"
+    return query.split(None, 1)[0].upper()
+
+
+class Repository:
+    """
+    Database access through the connection pool, with pool saturation stats.
+
+    Every query goes through `acquire`, which tracks how many callers are
+    waiting for a connection and how long they waited. Queries are constant
+    strings, so asyncpg's per-connection statement cache prepares each of them
+    once per connection and reuses the prepared statement after that.
+    """
+
+    def __init__(self, pool, *, max_size=None, metrics=None):
+        self.pool = pool
+        self.max_size = max_size
+        self.metrics = metrics
+
+        self.acquires = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.max_latency = 0.0
+        # Acquire latency (in seconds) of the latest acquires
+        self._latencies = collections.deque(maxlen=1024)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.acquire()
+        finally:
+            self.waiting -= 1
+
+        latency = time.perf_counter() - start
+        if self.metrics is not None:
+            self.metrics.observe("db", "acquire", latency)
+        self._latencies.append(latency)
+        self.max_latency = max(self.max_latency, latency)
+        self.acquires += 1
+        self.in_use += 1
+        try:
+            yield conn
+        finally:
+            self.in_use -= 1
+            await self.pool.release(conn)
+
+    def _timer(self, query: str):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.timer("db", query_name(query))
+
+    async def fetch(self, query: str, *args, **kwargs):
+        with self._timer(query):
+            async with self.acquire() as conn:
+                return await conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        with self._timer(query):
+            async with self.acquire() as conn:
+                return await conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        with self._timer(query):
+            async with self.acquire() as conn:
+                return await conn.fetchval(query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs):
+        with self._timer(query):
+            async with self.acquire() as conn:
+                return await conn.execute(query, *args, **kwargs)
+
+    async def executemany(self, query: str, args, **kwargs):
+        with self._timer(query):
+            async with self.acquire() as conn:
+                return await conn.executemany(query, args, **kwargs)
+
+    async def fetch_token(self, user_id: int):
+        return await self.fetchval(
+            "SELECT token FROM elearningbot.token WHERE user_id = $1", user_id
+        )
+
+    async def store_token(self, user_id: int, token: str):
+        await self.execute(
+            """
+            INSERT INTO elearningbot.token (user_id, token)
+            VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET token = EXCLUDED.token
+            """,
+            user_id,
+            token,
+        )
+
+    async def fetch_user_ids(self) -> list:
+        rows = await self.fetch("SELECT user_id FROM elearningbot.token")
+        return [row["user_id"] for row in rows]
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "acquires": self.acquires,
+            "in_use": self.in_use,
+            "max_size": self.max_size,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            "latency_max": self.max_latency,
+        }
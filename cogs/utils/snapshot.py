@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+
+class SnapshotRefresher:
+    """
+    Worker pool that keeps users' dashboard snapshots fresh in background.
+
+    Every `interval` seconds users whose snapshot is older than `max_age`
+    seconds (or missing) are queued, `workers` workers refresh them by calling
+    `cog.refresh_snapshot`.
+    """
+
+    def __init__(self, cog, *, workers=4, max_age=900, interval=60, batch_size=100):
+        self.cog = cog
+        self.bot = cog.bot
+        self.logger = logging.getLogger("discord")
+        self.workers = workers
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.refreshed = 0
+        self.failed = 0
+        self._queue = asyncio.Queue()
+        self._queued = set()
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(self.bot.loop.create_task(self.feed()))
+        for _ in range(self.workers):
+            self._tasks.append(self.bot.loop.create_task(self.work()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queued),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
+
+    def enqueue(self, user_id: int):
+        # Only runs in the leader process, other processes rely on `feed`
+        if not self._tasks or user_id in self._queued:
+            return
+        self._queued.add(user_id)
+        self._queue.put_nowait(user_id)
+
+    async def feed(self):
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                for user_id in await self.cog.fetch_outdated_snapshots(
+                    self.max_age, self.batch_size
+                ):
+                    self.enqueue(user_id)
+            except Exception as e:
+                self.logger.warning(f"Failed to queue snapshot refreshes: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    async def work(self):
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self.cog.refresh_snapshot(user_id)
+                self.refreshed += 1
+            except Exception as e:
+                self.failed += 1
+                self.logger.warning(
+                    f"Failed to refresh snapshot of user {user_id}: {e!r}"
+                )
+            finally:
+                self._queued.discard(user_id)
+                self._queue.task_done()
@@ -1,16 +1,73 @@
+import aiohttp
 import asyncio
-import asyncpg
 import click
 import contextlib
+import copy
 import discord
 import json
 import logging
+import logging.handlers
+import multiprocessing
+import queue
 
 from bot import ziBot
 
 
+class JSONFormatter(logging.Formatter):
+    """Format records as JSON lines."""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records with their traceback kept apart from the message.
+
+    The base class formats the traceback into the message, so the handlers
+    behind the queue (e.g. `JSONFormatter`) couldn't format it themselves.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        # Rendered into exc_text, don't keep the frames alive while queued
+        record.exc_info = None
+        return record
+
+
+def load_config() -> dict:
+    try:
+        with open("config.json", "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
 @contextlib.contextmanager
-def setup_logging():
+def setup_logging(filename="discord.log"):
+    """
+    Log to a rotating file and the console without blocking the event loop.
+
+    Records are put in a queue and written by a background thread.
+    """
+    config = load_config()
+    listener = None
     try:
         FORMAT = "%(asctime)s - [%(levelname)s]: %(message)s"
         DATE_FORMAT = "%d/%m/%Y (%H:%M:%S)"
@@ -18,17 +75,39 @@ def setup_logging():
         logger = logging.getLogger("discord")
         logger.setLevel(logging.INFO)
 
-        file_handler = logging.FileHandler(
-            filename="discord.log", mode="a", encoding="utf-8"
-        )
-        file_handler.setFormatter(logging.Formatter(fmt=FORMAT, datefmt=DATE_FORMAT))
+        if config.get("log_rotation", "size") == "time":
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                filename=filename,
+                when=config.get("log_rotation_when", "midnight"),
+                backupCount=config.get("log_backup_count", 5),
+                encoding="utf-8",
+            )
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                filename=filename,
+                mode="a",
+                maxBytes=config.get("log_max_bytes", 10 * 1024 * 1024),
+                backupCount=config.get("log_backup_count", 5),
+                encoding="utf-8",
+            )
+        if config.get("log_json", False):
+            file_handler.setFormatter(JSONFormatter(datefmt=DATE_FORMAT))
+        else:
+            file_handler.setFormatter(
+                logging.Formatter(fmt=FORMAT, datefmt=DATE_FORMAT)
+            )
         file_handler.setLevel(logging.INFO)
-        logger.addHandler(file_handler)
 
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(logging.Formatter(fmt=FORMAT, datefmt=DATE_FORMAT))
         console_handler.setLevel(logging.WARNING)
-        logger.addHandler(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        listener.start()
+        logger.addHandler(LogQueueHandler(log_queue))
 
         yield
     finally:
@@ -36,6 +115,11 @@ def setup_logging():
         for handler in handlers:
             handler.close()
             logger.removeHandler(handler)
+        if listener is not None:
+            # Writes what's left in the queue
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
 
 
 def check_json():
@@ -56,25 +140,12 @@ def check_json():
 
 
 def init_bot():
-    loop = asyncio.get_event_loop()
-    logger = logging.getLogger()
-
     try:
         check_json()
     except FileNotFoundError:
         return
 
-    with open("config.json", "r") as f:
-        config = json.load(f)
-
-    try:
-        pool = loop.run_until_complete(asyncpg.create_pool(config["postgresql"]))
-    except Exception as e:
-        logger.error("Could not set up PostgreSQL. Exiting.")
-        return
-
     bot = ziBot()
-    bot.pool = pool
     bot.run()
 
 
@@ -88,5 +159,70 @@ def main(ctx):
             init_bot()
 
 
+async def fetch_shard_count(token: str) -> int:
+    """Get Discord's recommended shard count."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v8/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["shards"]
+
+
+def run_cluster(shard_ids, shard_count):
+    # Forked processes must not share the parent's loop (and its selector)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    # Rotating a file shared by multiple processes isn't safe
+    with setup_logging(f"discord.{multiprocessing.current_process().name}.log"):
+        bot = ziBot(shard_ids=shard_ids, shard_count=shard_count)
+        bot.run()
+
+
+@main.command()
+@click.option("--processes", "-p", default=2, help="Number of bot processes.")
+@click.option(
+    "--shards",
+    "-s",
+    type=int,
+    help="Total shards, defaults to Discord's recommendation.",
+)
+def cluster(processes, shards):
+    """Launch the bot as multiple processes, each running some of the shards."""
+    try:
+        check_json()
+    except FileNotFoundError:
+        return
+
+    with open("config.json", "r") as f:
+        config = json.load(f)
+
+    shards = shards or config.get("shard_count")
+    if not shards:
+        # Closes the loop before forking the workers
+        shards = asyncio.run(fetch_shard_count(config["bot_token"]))
+    processes = max(1, min(processes, shards))
+
+    workers = []
+    for i in range(processes):
+        # Contiguous ranges of shard ids
+        shard_ids = list(range(i * shards // processes, (i + 1) * shards // processes))
+        worker = multiprocessing.Process(
+            target=run_cluster, args=(shard_ids, shards), name=f"cluster-{i}"
+        )
+        worker.start()
+        workers.append(worker)
+        click.echo(f"Started cluster-{i} (PID: {worker.pid}) with shards {shard_ids}")
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
 if __name__ == "__main__":
     main()